@@ -0,0 +1,344 @@
+"""
+=============================================================
+  HISTORIAL DE COSTOS - Versiones sucesivas del Excel
+  Guarda en Parquet (columnar) solo las filas de Explosión y
+  Tiempos que cambian en cada versión, y el costo de los PT
+  afectados con la atribución del cambio a precio, tarifa,
+  tiempo o estructura.
+
+  Uso:
+    python historial_costos.py ingresar marzo.xlsx abril.xlsx
+    python historial_costos.py ingresar mayo.xlsx --etiqueta 2026-05
+    python historial_costos.py versiones
+    python historial_costos.py serie 2110020095
+=============================================================
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# ─── CONFIGURACIÓN ─────────────────────────────────────────
+CARPETA_HISTORIAL = os.environ.get("CARPETA_HISTORIAL", "historial")
+TABLAS = {
+    "explosion": {
+        "clave":   ["Código PT", "Código Semi", "Componente"],
+        "valores": ["Descripción PT", "Descripción Semi", "Descripción Componente",
+                    "Familia", "Cantidad Total Requerida", "Cantidad Base",
+                    "Costo estandar"],
+    },
+    "tiempos": {
+        "clave":   ["Código Semi"],
+        "valores": ["Descripción Semi", "Proceso", "Maquina", "Cantidad Base",
+                    "T.MO", "T.Maq", "Cant.Opr", "Tarifa Maquina", "Tarifa MO",
+                    "T.ciclo", "Cav. Oper", "Cav. Tot"],
+    },
+}
+# Pasos de la atribución: columnas de la versión nueva que se aplican, en orden,
+# sobre la anterior. Lo que queda sin explicar se atribuye a la estructura.
+PASOS_ATRIBUCION = [
+    ("Δ Precio", "explosion", ["Costo estandar"]),
+    ("Δ Tarifa", "tiempos",   ["Tarifa Maquina", "Tarifa MO"]),
+    ("Δ Tiempo", "tiempos",   ["Cantidad Base", "T.MO", "T.Maq"]),
+]
+COLUMNAS_COSTO = ["Costo x Und", "CM", "CIF", "MOD"]
+# ───────────────────────────────────────────────────────────
+
+
+def _ruta(*partes):
+    return os.path.join(CARPETA_HISTORIAL, *partes)
+
+
+def _escribir(df, ruta):
+    """Escritura atómica: otro proceso nunca lee un Parquet a medias."""
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    df.to_parquet(ruta + ".tmp", index=False)
+    os.replace(ruta + ".tmp", ruta)
+
+
+# ── Catálogo de versiones ───────────────────────────────────
+def versiones():
+    ruta = _ruta("versiones.parquet")
+    if not os.path.exists(ruta):
+        return pd.DataFrame(columns=["Versión", "Etiqueta", "Huella", "Archivo",
+                                     "Ingresado", "PT recosteados"])
+    return pd.read_parquet(ruta)
+
+
+def _leer_deltas(nombre, hasta=None):
+    """Filas guardadas de `nombre` para todas las versiones (o hasta una)."""
+    cat   = versiones()
+    if hasta is not None:
+        cat = cat[cat["Versión"] <= hasta]
+    partes = [pd.read_parquet(_ruta(f"v{v:04d}", f"{nombre}.parquet"))
+              for v in cat["Versión"]
+              if os.path.exists(_ruta(f"v{v:04d}", f"{nombre}.parquet"))]
+    return pd.concat(partes, ignore_index=True) if partes else None
+
+
+# ── Filas por versión ───────────────────────────────────────
+def _normalizar(df, tabla):
+    """Tabla a guardar: clave + ocurrencia (claves repetidas en el Excel) +
+    posición original, para reconstruir el libro en el mismo orden."""
+    spec  = TABLAS[tabla]
+    clave = spec["clave"]
+    out   = df[clave + [c for c in spec["valores"] if c in df.columns]].copy()
+    for c in spec["valores"]:
+        if c not in out.columns:
+            out[c] = pd.NA
+    for c in clave + ["Descripción PT", "Descripción Semi", "Descripción Componente",
+                      "Familia", "Proceso", "Maquina"]:
+        if c in out.columns:
+            out[c] = out[c].astype(str)
+    out["_n"]     = out.groupby(clave, sort=False).cumcount()
+    out["_orden"] = range(len(out))
+    return out
+
+
+def reconstruir(tabla, version):
+    """Estado completo de la tabla en una versión, a partir de los deltas."""
+    filas = _leer_deltas(tabla, hasta=version)
+    if filas is None:
+        return None
+    clave = TABLAS[tabla]["clave"] + ["_n"]
+    filas = filas.sort_values("Versión", kind="stable") \
+                 .drop_duplicates(clave, keep="last")
+    filas = filas[~filas["_eliminado"]]
+    return filas.sort_values("_orden").drop(columns=["Versión", "_eliminado"]) \
+                .reset_index(drop=True)
+
+
+def _cambios(nueva, anterior, tabla):
+    """Filas nuevas o modificadas, y claves eliminadas marcadas como tales."""
+    clave = TABLAS[tabla]["clave"] + ["_n"]
+    nueva = nueva.assign(_eliminado=False)
+    if anterior is None:
+        return nueva
+    # La posición no cuenta como cambio: insertar una fila no debe reescribir las siguientes
+    valores = [c for c in nueva.columns if c not in clave + ["_eliminado", "_orden"]]
+    unido   = nueva.merge(anterior, on=clave, how="left", suffixes=("", "__ant"),
+                          indicator=True)
+    cambio  = unido["_merge"] == "left_only"
+    for c in valores:
+        a, b   = unido[c], unido[c + "__ant"]
+        cambio |= ~((a == b).fillna(False) | (a.isna() & b.isna()))
+    eliminadas = anterior.merge(nueva[clave], on=clave, how="left", indicator=True)
+    eliminadas = eliminadas[eliminadas["_merge"] == "left_only"] \
+                 .drop(columns="_merge").assign(_eliminado=True)
+    return pd.concat([nueva[cambio.to_numpy()], eliminadas], ignore_index=True)
+
+
+def _a_libro(tabla_exp, tabla_tie):
+    """Devuelve las tablas guardadas a la forma de df_exp / df_tie del reporte."""
+    df_e = tabla_exp.drop(columns=["_n", "_orden"]).reset_index(drop=True)
+    df_t = tabla_tie.drop(columns=["_n", "_orden"]).reset_index(drop=True)
+    for c in ["Cantidad Base", "T.MO", "T.Maq", "Tarifa Maquina", "Tarifa MO"]:
+        df_t[c] = pd.to_numeric(df_t[c], errors="coerce").fillna(0).astype(float)
+    return df_e, df_t
+
+
+def _sustituir(base, nueva, tabla, columnas):
+    """`base` con los valores de `columnas` tomados de `nueva` donde la clave coincide."""
+    clave = TABLAS[tabla]["clave"] + ["_n"]
+    out   = base.copy()
+    nuevos = base[clave].merge(nueva[clave + columnas], on=clave, how="left")
+    for c in columnas:
+        out[c] = nuevos[c].where(nuevos[c].notna(), base[c]).to_numpy()
+    return out
+
+
+# ── Costeo ──────────────────────────────────────────────────
+def costear(pts, df_e, df_t, motor, validacion=None):
+    """Costo por unidad (total y por tipo) de los PT con el motor del reporte."""
+    validacion = validacion or motor.validar_bom(df_e, df_t)
+    filas = []
+    for pt in pts:
+        plan = validacion["planes"].get(pt)
+        resumen, _, costo = motor.explotar_pt(pt, df_e, df_t, validacion)
+        cant_base = float(df_e.at[plan["raiz"][0][0], "Cantidad Base"]) \
+                    if plan and plan["raiz"] else 1
+        cant_base = cant_base or 1
+        filas.append({"Código PT": pt, "Costo x Und": costo,
+                      **{t: sum(v[t] for v in resumen.values()) / cant_base
+                         for t in ["CM", "CIF", "MOD"]}})
+    return pd.DataFrame(filas, columns=["Código PT"] + COLUMNAS_COSTO).set_index("Código PT")
+
+
+def pts_afectados(cambios_exp, cambios_tie, validacion):
+    """PT cuyo costo puede haber cambiado: filas propias de la Explosión
+    modificadas, o un semi de su estructura con Tiempos modificado."""
+    pts = set(cambios_exp["Código PT"])
+    semis = set(cambios_tie["Código Semi"])
+    if semis:
+        for pt, plan in validacion["planes"].items():
+            if pt in semis or any(n["semi"] in semis for n in plan["nodos"]):
+                pts.add(pt)
+    return pts
+
+
+# ── Ingreso de versiones ────────────────────────────────────
+def ingresar(ruta, motor, etiqueta=None):
+    """Agrega una versión del Excel al historial. Solo guarda filas cambiadas
+    y solo recostea los PT que esos cambios tocan. Devuelve el número de versión."""
+    huella = motor.version_libro(ruta)
+    cat    = versiones()
+    if huella in set(cat["Huella"]):
+        return int(cat.loc[cat["Huella"] == huella, "Versión"].iloc[0])
+    version  = int(cat["Versión"].max()) + 1 if len(cat) else 1
+    anterior = int(cat["Versión"].max()) if len(cat) else None
+    etiqueta = etiqueta or datetime.fromtimestamp(os.path.getmtime(ruta)).strftime("%Y-%m-%d")
+
+    df_e, df_t, _ = motor.leer_libro(ruta)
+    nueva_exp = _normalizar(df_e, "explosion")
+    nueva_tie = _normalizar(df_t, "tiempos")
+    ant_exp   = reconstruir("explosion", anterior) if anterior else None
+    ant_tie   = reconstruir("tiempos",   anterior) if anterior else None
+    cambios_exp = _cambios(nueva_exp, ant_exp, "explosion")
+    cambios_tie = _cambios(nueva_tie, ant_tie, "tiempos")
+
+    lib_e, lib_t = _a_libro(nueva_exp, nueva_tie)
+    val_nueva    = motor.validar_bom(lib_e, lib_t)
+    pts_nuevos   = set(lib_e["Código PT"])
+    afectados    = sorted(pts_afectados(cambios_exp, cambios_tie, val_nueva)
+                          if anterior else pts_nuevos)
+
+    vigentes  = [pt for pt in afectados if pt in pts_nuevos]
+    costos    = costear(vigentes, lib_e, lib_t, motor, val_nueva)
+    for paso, _, _ in PASOS_ATRIBUCION:
+        costos[paso] = 0.0
+    costos["Δ Estructura"] = 0.0
+
+    pts_anteriores = set(ant_exp["Código PT"]) if anterior else set()
+    previos = [pt for pt in vigentes if pt in pts_anteriores]
+    if previos:
+        # Sustitución secuencial: cada paso aplica columnas de la versión nueva
+        # sobre la anterior; la estructura (filas) sigue siendo la anterior.
+        exp_paso, tie_paso = ant_exp, ant_tie
+        val_ant = motor.validar_bom(*_a_libro(ant_exp, ant_tie))
+        ultimo  = costear(previos, *_a_libro(exp_paso, tie_paso), motor, val_ant)["Costo x Und"]
+        for paso, tabla, columnas in PASOS_ATRIBUCION:
+            if tabla == "explosion":
+                exp_paso = _sustituir(exp_paso, nueva_exp, tabla, columnas)
+            else:
+                tie_paso = _sustituir(tie_paso, nueva_tie, tabla, columnas)
+            costo_paso = costear(previos, *_a_libro(exp_paso, tie_paso), motor,
+                                 val_ant)["Costo x Und"]
+            costos.loc[previos, paso] = costo_paso - ultimo
+            ultimo = costo_paso
+        costos.loc[previos, "Δ Estructura"] = costos.loc[previos, "Costo x Und"] - ultimo
+
+    descripciones = lib_e.drop_duplicates("Código PT").set_index("Código PT")["Descripción PT"]
+    costos = costos.reset_index()
+    costos["Descripción PT"] = costos["Código PT"].map(descripciones).astype(str)
+    costos["_eliminado"] = False
+    retirados = [pt for pt in afectados if pt not in pts_nuevos]
+    if retirados:
+        costos = pd.concat([costos, pd.DataFrame({"Código PT": retirados,
+                                                  "_eliminado": True})],
+                           ignore_index=True)
+
+    for nombre, df in [("explosion", cambios_exp), ("tiempos", cambios_tie), ("costos", costos)]:
+        _escribir(df.assign(Versión=version), _ruta(f"v{version:04d}", f"{nombre}.parquet"))
+    fila = pd.DataFrame([{"Versión": version, "Etiqueta": etiqueta, "Huella": huella,
+                          "Archivo": os.path.basename(ruta),
+                          "Ingresado": datetime.now().isoformat(timespec="seconds"),
+                          "PT recosteados": len(afectados)}])
+    _escribir(pd.concat([cat, fila], ignore_index=True) if len(cat) else fila,
+              _ruta("versiones.parquet"))
+    return version
+
+
+def ingresar_si_nueva(ruta, motor):
+    """Registra el Excel actual al arrancar, si todavía no está en el historial.
+    Un archivo de bloqueo evita que varios workers lo ingresen a la vez."""
+    if motor.version_libro(ruta) in set(versiones()["Huella"]):
+        return None
+    os.makedirs(CARPETA_HISTORIAL, exist_ok=True)
+    bloqueo = _ruta(".ingresando")
+    if os.path.exists(bloqueo) and time.time() - os.path.getmtime(bloqueo) > 600:
+        os.remove(bloqueo)  # bloqueo huérfano de un proceso que murió
+    try:
+        fd = os.open(bloqueo, os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return None
+    try:
+        os.close(fd)
+        return ingresar(ruta, motor)
+    finally:
+        os.remove(bloqueo)
+
+
+# ── Series ──────────────────────────────────────────────────
+_cache_series = {}  # mtime del catálogo -> series
+
+
+def series_costos():
+    """Costo por PT en cada versión. Los PT no recosteados en una versión
+    conservan su último costo; los retirados quedan vacíos desde entonces."""
+    ruta  = _ruta("versiones.parquet")
+    marca = os.path.getmtime(ruta) if os.path.exists(ruta) else None
+    if marca not in _cache_series:
+        _cache_series.clear()
+        _cache_series[marca] = _calcular_series()
+    return _cache_series[marca]
+
+
+def _calcular_series():
+    filas = _leer_deltas("costos")
+    cat   = versiones()
+    if filas is None:
+        return pd.DataFrame()
+    rejilla = pd.MultiIndex.from_product([filas["Código PT"].unique(), cat["Versión"]],
+                                         names=["Código PT", "Versión"])
+    serie = filas.set_index(["Código PT", "Versión"]).reindex(rejilla)
+    serie = serie.groupby(level=0).ffill()
+    # Los deltas de atribución no se arrastran: valen solo en su versión
+    for c in [p for p, _, _ in PASOS_ATRIBUCION] + ["Δ Estructura"]:
+        serie[c] = filas.set_index(["Código PT", "Versión"])[c].reindex(rejilla).fillna(0)
+    serie = serie[~serie["_eliminado"].fillna(True).astype(bool)].drop(columns="_eliminado")
+    serie = serie.reset_index().merge(cat[["Versión", "Etiqueta"]], on="Versión")
+    return serie
+
+
+def serie_pt(codigo_pt):
+    serie = series_costos()
+    if serie.empty:
+        return serie
+    return serie[serie["Código PT"] == str(codigo_pt)].sort_values("Versión")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Historial de costos por versión del Excel.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_ing = sub.add_parser("ingresar", help="agregar versiones (en orden cronológico)")
+    p_ing.add_argument("archivos", nargs="+")
+    p_ing.add_argument("--etiqueta", default=None, help="solo con un archivo")
+    sub.add_parser("versiones", help="listar versiones ingresadas")
+    p_ser = sub.add_parser("serie", help="serie de costo de un PT")
+    p_ser.add_argument("codigo_pt")
+    args = parser.parse_args()
+
+    if args.comando == "ingresar":
+        # Solo se ingresan los archivos indicados, nunca el Excel del tablero
+        os.environ["INGRESAR_HISTORIAL"] = "0"
+        import reporte_costos_web as motor
+        for archivo in args.archivos:
+            inicio  = time.perf_counter()
+            version = ingresar(archivo, motor,
+                               args.etiqueta if len(args.archivos) == 1 else None)
+            fila = versiones().set_index("Versión").loc[version]
+            print(f"✅ {archivo} → versión {version} ({fila['Etiqueta']}), "
+                  f"{fila['PT recosteados']} PT recosteados en "
+                  f"{time.perf_counter() - inicio:.1f}s")
+    elif args.comando == "versiones":
+        print(versiones().to_string(index=False))
+    else:
+        print(serie_pt(args.codigo_pt).drop(columns=["Código PT"]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""
+=============================================================
+  PRUEBA DE CARGA - Callbacks del reporte de costos
+  Simula planificadores concurrentes contra los endpoints
+  reales /_dash-update-component de `server`, sin red externa.
+
+  Uso:
+    python prueba_carga.py --usuarios 8 --duracion 30
+    python prueba_carga.py --sintetico 200 --usuarios 16
+    python prueba_carga.py --gunicorn 2 --usuarios 16
+    python prueba_carga.py --comparar resultados_carga/anterior.json
+=============================================================
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# ─── CONFIGURACIÓN ─────────────────────────────────────────
+ARCHIVO_DATOS   = "Analisis de costos_PY.xlsx"
+CARPETA_RESULT  = "resultados_carga"
+MEZCLA_DEFECTO  = {"cambio_pt": 0.6, "recalcular": 0.4}
+# ───────────────────────────────────────────────────────────
+
+
+# ── Libro sintético ─────────────────────────────────────────
+def generar_libro_sintetico(destino, n_pt, origen=ARCHIVO_DATOS):
+    """Replica los PT del libro original con códigos nuevos hasta tener al
+    menos `n_pt`. Los semis se comparten, así la estructura sigue siendo real."""
+    hojas = pd.read_excel(origen, sheet_name=None)
+    exp   = hojas["Explosión"].copy()
+    tie   = hojas["Tiempos"].copy()
+    exp.columns = exp.columns.str.strip()
+    tie.columns = tie.columns.str.strip()
+    exp["Código PT"]   = exp["Código PT"].astype(str).str.strip()
+    exp["Código Semi"] = exp["Código Semi"].astype(str).str.strip()
+    tie["Código Semi"] = tie["Código Semi"].astype(str).str.strip()
+
+    pts    = list(exp["Código PT"].unique())
+    copias = [exp]
+    rutas  = [tie]
+    for i in range(max(0, -(-n_pt // len(pts)) - 1)):
+        for j, pt in enumerate(pts):
+            nuevo = f"9{i:04d}{j:05d}"  # único por (copia, PT) aunque los códigos coincidan al final
+            filas = exp[exp["Código PT"] == pt].copy()
+            filas.loc[filas["Código Semi"] == pt, "Código Semi"] = nuevo
+            filas["Código PT"] = nuevo
+            filas["Descripción PT"] = filas["Descripción PT"].astype(str) + f" (copia {i + 1})"
+            copias.append(filas)
+            ruta = tie[tie["Código Semi"] == pt].copy()
+            ruta["Código Semi"] = nuevo
+            rutas.append(ruta)
+
+    hojas["Explosión"] = pd.concat(copias, ignore_index=True)
+    hojas["Tiempos"]   = pd.concat(rutas,  ignore_index=True)
+    with pd.ExcelWriter(destino) as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, sheet_name=nombre, index=False)
+    return destino
+
+
+def lista_pt(archivo):
+    exp = pd.read_excel(archivo, sheet_name="Explosión")
+    exp.columns = exp.columns.str.strip()
+    return list(exp["Código PT"].astype(str).str.strip().unique())
+
+
+# ── Clientes ────────────────────────────────────────────────
+class ClienteLocal:
+    """Flask test client sobre el `server` importado en este proceso."""
+
+    def __init__(self, server):
+        self.server = server
+        self.local  = threading.local()
+
+    def _cliente(self):
+        if not hasattr(self.local, "c"):
+            self.local.c = self.server.test_client()
+        return self.local.c
+
+    def get(self, ruta):
+        return self._cliente().get(ruta).get_json()
+
+    def post(self, ruta, cuerpo):
+        res = self._cliente().post(ruta, json=cuerpo)
+        return res.status_code, res.get_json(silent=True)
+
+
+class ClienteHTTP:
+    """Cliente HTTP contra un servidor local (gunicorn o `python reporte_costos_web.py`)."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def get(self, ruta):
+        with urllib.request.urlopen(self.url + ruta) as res:
+            return json.loads(res.read())
+
+    def post(self, ruta, cuerpo):
+        req = urllib.request.Request(self.url + ruta, data=json.dumps(cuerpo).encode(),
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req) as res:
+                return res.status, json.loads(res.read())
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+@contextlib.contextmanager
+def gunicorn_local(workers, entorno):
+    """Levanta gunicorn en un puerto libre de 127.0.0.1 y espera a que responda."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        puerto = sock.getsockname()[1]
+    url  = f"http://127.0.0.1:{puerto}"
+    proc = subprocess.Popen(
+        ["gunicorn", "reporte_costos_web:server", "--workers", str(workers),
+         "--bind", f"127.0.0.1:{puerto}", "--timeout", "120"],
+        env={**os.environ, **entorno}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(240):
+            try:
+                urllib.request.urlopen(url + "/_dash-dependencies", timeout=1)
+                break
+            except OSError:
+                if proc.poll() is not None:
+                    raise RuntimeError("gunicorn terminó antes de responder")
+                time.sleep(0.5)
+        else:
+            raise RuntimeError("gunicorn no respondió a tiempo")
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+# ── Callbacks ───────────────────────────────────────────────
+class Callbacks:
+    """Arma los cuerpos de /_dash-update-component a partir de /_dash-dependencies."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self.deps    = {}
+        for dep in cliente.get("/_dash-dependencies"):
+            primero = dep["output"].strip(".").split("...")[0].split("@")[0]
+            self.deps[primero] = dep
+
+    def llamar(self, salida, valores, cambiados):
+        """Dispara el callback cuya primera salida es `salida`. `valores` va
+        indexado por "id.propiedad"; devuelve (segundos, ok, respuesta)."""
+        dep = self.deps[salida]
+
+        def spec(s):
+            i, p = s.rsplit(".", 1)
+            return {"id": i, "property": p.split("@")[0]}
+
+        def valor(x):
+            return {**x, "value": valores.get(f"{x['id']}.{x['property']}")}
+
+        salidas = [spec(s) for s in dep["output"].strip(".").split("...")]
+        cuerpo  = {"output": dep["output"],
+                   "outputs": salidas if dep["output"].startswith("..") else salidas[0],
+                   "inputs": [valor(x) for x in dep["inputs"]],
+                   "state":  [valor(x) for x in dep["state"]],
+                   "changedPropIds": cambiados}
+        inicio = time.perf_counter()
+        codigo, resp = self.cliente.post("/_dash-update-component", cuerpo)
+        return time.perf_counter() - inicio, codigo == 200, (resp or {}).get("response", {})
+
+
+NOMBRES = {
+    "tabla-simulador.data":  "cargar_simuladores",
+    "tabla-materiales.data": "cargar_materiales",
+    "kpis.children":         "actualizar",
+    "selector-pt.options":   "opciones_pt",
+}
+
+
+class Planificador:
+    """Un usuario simulado: cambia de PT y recalcula con ediciones aleatorias."""
+
+    def __init__(self, callbacks, pts, mezcla, semilla):
+        self.cb      = callbacks
+        self.pts     = pts
+        self.mezcla  = mezcla
+        self.rnd     = random.Random(semilla)
+        self.pt      = None
+        self.tablas  = {}
+        self.clicks  = 0
+
+    def _registrar(self, registro, salida, resultado):
+        segundos, ok, resp = resultado
+        registro.append((NOMBRES.get(salida, salida), segundos, ok))
+        return resp
+
+    def _actualizar(self, registro, cambiado):
+        valores = {"selector-pt.value": self.pt, "btn-recalcular.n_clicks": self.clicks or None,
+                   "selector-escenario.value": None,
+                   "tabla-simulador.data": self.tablas.get("iny"),
+                   "tabla-simulador-otros.data": self.tablas.get("otros"),
+                   "tabla-materiales.data": self.tablas.get("precios")}
+        self._registrar(registro, "kpis.children",
+                        self.cb.llamar("kpis.children", valores, [cambiado]))
+
+    def cambio_pt(self, registro):
+        nuevo = self.rnd.choice(self.pts)
+        # El usuario teclea parte del código antes de elegir el PT
+        self._registrar(registro, "selector-pt.options",
+                        self.cb.llamar("selector-pt.options",
+                                       {"selector-pt.search_value": nuevo[:self.rnd.randint(2, 6)],
+                                        "selector-pt.value": self.pt},
+                                       ["selector-pt.search_value"]))
+        self.pt = nuevo
+        valores = {"selector-pt.value": self.pt, "selector-escenario.value": None}
+        resp = self._registrar(registro, "tabla-simulador.data",
+                               self.cb.llamar("tabla-simulador.data", valores,
+                                              ["selector-pt.value"]))
+        self.tablas["iny"]   = resp.get("tabla-simulador", {}).get("data", [])
+        self.tablas["otros"] = resp.get("tabla-simulador-otros", {}).get("data", [])
+        resp = self._registrar(registro, "tabla-materiales.data",
+                               self.cb.llamar("tabla-materiales.data", valores,
+                                              ["selector-pt.value"]))
+        self.tablas["precios"] = resp.get("tabla-materiales", {}).get("data", [])
+        self._actualizar(registro, "selector-pt.value")
+
+    def recalcular(self, registro):
+        if self.pt is None:
+            return self.cambio_pt(registro)
+        for seccion, campo in [("iny", "T.Ciclo"), ("otros", "T.MO"), ("precios", "Precio")]:
+            filas = self.tablas.get(seccion) or []
+            if filas:
+                fila = self.rnd.choice(filas)
+                fila[campo] = round(float(fila.get(campo) or 0) * self.rnd.uniform(0.9, 1.1), 6)
+        self.clicks += 1
+        self._actualizar(registro, "btn-recalcular.n_clicks")
+
+    def correr(self, hasta, pausa):
+        registro = []
+        acciones = list(self.mezcla)
+        pesos    = [self.mezcla[a] for a in acciones]
+        while time.perf_counter() < hasta:
+            getattr(self, self.rnd.choices(acciones, pesos)[0])(registro)
+            if pausa:
+                time.sleep(self.rnd.uniform(0, 2 * pausa))
+        return registro
+
+
+# ── Estadísticas ────────────────────────────────────────────
+def resumir(registros, segundos):
+    df = pd.DataFrame(registros, columns=["Callback", "Latencia", "OK"])
+    stats = {}
+    for nombre, grupo in df.groupby("Callback"):
+        lat = grupo["Latencia"].to_numpy() * 1000
+        stats[nombre] = {
+            "n": int(len(grupo)), "errores": int((~grupo["OK"]).sum()),
+            "throughput_rps": round(len(grupo) / segundos, 2),
+            "p50_ms": round(float(np.percentile(lat, 50)), 1),
+            "p95_ms": round(float(np.percentile(lat, 95)), 1),
+            "p99_ms": round(float(np.percentile(lat, 99)), 1),
+            "max_ms": round(float(lat.max()), 1),
+        }
+    return {"total_requests": int(len(df)),
+            "throughput_rps": round(len(df) / segundos, 2),
+            "callbacks": stats}
+
+
+def imprimir(resultado, anterior=None):
+    print(f"\n📊 {resultado['total_requests']} requests — "
+          f"{resultado['throughput_rps']} req/s "
+          f"({resultado['config']['usuarios']} usuarios, {resultado['config']['modo']})")
+    print(f"{'Callback':<22}{'n':>7}{'err':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for nombre, s in resultado["callbacks"].items():
+        print(f"{nombre:<22}{s['n']:>7}{s['errores']:>6}{s['throughput_rps']:>9}"
+              f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}")
+        previo = (anterior or {}).get("callbacks", {}).get(nombre)
+        if previo:
+            deltas = "".join(f"{(s[k] - previo[k]) / previo[k] * 100 if previo[k] else 0:>+8.1f}%"
+                             for k in ["throughput_rps", "p50_ms", "p95_ms", "p99_ms"])
+            print(f"{'  vs ' + anterior['version']:<35}{deltas}")
+
+
+def version_codigo():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "sin-git"
+
+
+def guardar(resultado):
+    os.makedirs(CARPETA_RESULT, exist_ok=True)
+    ruta = os.path.join(CARPETA_RESULT, f"{datetime.now():%Y%m%d_%H%M%S}_{resultado['version']}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    return ruta
+
+
+def ultimo_resultado():
+    archivos = sorted(glob.glob(os.path.join(CARPETA_RESULT, "*.json")))
+    if not archivos:
+        return None
+    with open(archivos[-1], encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ── Ejecución ───────────────────────────────────────────────
+def ejecutar(cliente, pts, args):
+    callbacks = Callbacks(cliente)
+    hasta     = time.perf_counter() + args.duracion
+    inicio    = time.perf_counter()
+    with ThreadPoolExecutor(args.usuarios) as pool:
+        futuros = [pool.submit(Planificador(callbacks, pts, args.mezcla, args.semilla + i)
+                               .correr, hasta, args.pausa)
+                   for i in range(args.usuarios)]
+        registros = [r for f in futuros for r in f.result()]
+    return resumir(registros, time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de los callbacks Dash.")
+    parser.add_argument("--usuarios",  type=int,   default=4,  help="planificadores concurrentes")
+    parser.add_argument("--duracion",  type=float, default=20, help="segundos de prueba")
+    parser.add_argument("--pausa",     type=float, default=0,  help="pausa media entre acciones (s)")
+    parser.add_argument("--recalculos", type=float, default=MEZCLA_DEFECTO["recalcular"],
+                        help="fracción de acciones que son Recalcular (el resto, cambio de PT)")
+    parser.add_argument("--sintetico", type=int,   default=0,  help="generar un libro con N PTs")
+    parser.add_argument("--gunicorn",  type=int,   default=0,  help="levantar gunicorn con N workers")
+    parser.add_argument("--url",       default=None, help="servidor local ya levantado")
+    parser.add_argument("--semilla",   type=int,   default=0)
+    parser.add_argument("--comparar",  default=None,
+                        help="JSON de una corrida anterior (por defecto, la última guardada)")
+    parser.add_argument("--no-guardar", action="store_true")
+    args = parser.parse_args()
+    args.mezcla = {"cambio_pt": 1 - args.recalculos, "recalcular": args.recalculos}
+
+    temporal = tempfile.mkdtemp(prefix="prueba_carga_")
+    archivo  = os.path.abspath(ARCHIVO_DATOS)
+    if args.sintetico:
+        archivo = generar_libro_sintetico(os.path.join(temporal, "sintetico.xlsx"), args.sintetico)
+        print(f"🧪 Libro sintético: {archivo}")
+    entorno = {"ARCHIVO_DATOS": archivo,
+               "ARCHIVO_ESCENARIOS": os.path.join(temporal, "escenarios.sqlite"),
+               "CARPETA_HISTORIAL": os.path.join(temporal, "historial")}
+    pts = lista_pt(archivo)
+
+    try:
+        if args.url:
+            modo = f"http {args.url}"
+            resultado = ejecutar(ClienteHTTP(args.url), pts, args)
+        elif args.gunicorn:
+            modo = f"gunicorn x{args.gunicorn}"
+            with gunicorn_local(args.gunicorn, entorno) as url:
+                resultado = ejecutar(ClienteHTTP(url), pts, args)
+        else:
+            modo = "flask test client"
+            os.environ.update(entorno)
+            with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+                import reporte_costos_web
+                resultado = ejecutar(ClienteLocal(reporte_costos_web.server), pts, args)
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+    anterior = ultimo_resultado()
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+    resultado = {"version": version_codigo(), "fecha": datetime.now().isoformat(timespec="seconds"),
+                 "config": {"usuarios": args.usuarios, "duracion": args.duracion,
+                            "pausa": args.pausa, "mezcla": args.mezcla, "modo": modo,
+                            "pts": len(pts), "sintetico": args.sintetico},
+                 **resultado}
+    imprimir(resultado, anterior)
+    if not args.no_guardar:
+        print(f"💾 Resultados guardados en {guardar(resultado)}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,16 +8,33 @@
 
 import pandas as pd
 import os
+import io
+import base64
+import json
+import sqlite3
+import hashlib
+import bisect
+import itertools
+import unicodedata
+from collections import ChainMap
+from contextlib import closing
+from functools import lru_cache
 from datetime import datetime
 import plotly.graph_objects as go
-from dash import Dash, html, dcc, Input, Output, dash_table, State
+from dash import Dash, html, dcc, Input, Output, dash_table, State, ctx
+from dash.exceptions import PreventUpdate
+import historial_costos
 
 # ─── CONFIGURACIÓN ─────────────────────────────────────────
-ARCHIVO_DATOS    = "Analisis de costos_PY.xlsx"
+ARCHIVO_DATOS    = os.environ.get("ARCHIVO_DATOS", "Analisis de costos_PY.xlsx")
 HOJA_EXPLOSION   = "Explosión"
 HOJA_TIEMPOS     = "Tiempos"
 PREFIJO_FABRIC   = "231"
 PROCESOS_EXCLUIR = []
+ARCHIVO_ESCENARIOS = os.environ.get("ARCHIVO_ESCENARIOS", "escenarios.sqlite")
+HORAS_PERIODO    = 24 * 26   # capacidad por máquina y periodo (26 días a 24 h)
+# Registrar el Excel en el historial al arrancar (solo el servidor desplegado)
+INGRESAR_HISTORIAL = os.environ.get("INGRESAR_HISTORIAL") == "1"
 # ───────────────────────────────────────────────────────────
 
 # ── Cargar datos ────────────────────────────────────────────
@@ -28,50 +45,200 @@ if not os.path.exists(ARCHIVO_DATOS):
     print(f"❌ ERROR: No se encontró {ARCHIVO_DATOS}")
     sys.exit(1)
 print(f"✅ Excel encontrado: {ARCHIVO_DATOS}")
-df_exp = pd.read_excel(ARCHIVO_DATOS, sheet_name=HOJA_EXPLOSION)
-df_tie = pd.read_excel(ARCHIVO_DATOS, sheet_name=HOJA_TIEMPOS)
-try:
-    df_mat = pd.read_excel(ARCHIVO_DATOS, sheet_name="Materiales")
-    df_mat.columns = df_mat.columns.str.strip()
-    df_mat["Codigo"] = df_mat["Codigo"].astype(str).str.strip()
-    print("✅ Hoja Materiales cargada")
-except:
-    df_mat = pd.DataFrame(columns=["Codigo","Descripción","UM","TIPO DE COMPRA","MOQ","LT-días","Tipo"])
-    print("⚠️ Hoja Materiales no encontrada, usando vacío")
-
-df_exp.columns = df_exp.columns.str.strip()
-df_tie.columns = df_tie.columns.str.strip()
-
-for col in ["Código PT", "Código Semi", "Componente", "Familia"]:
-    if col in df_exp.columns:
-        df_exp[col] = df_exp[col].astype(str).str.strip()
-df_tie["Código Semi"] = df_tie["Código Semi"].astype(str).str.strip()
-
-for col in ["Cantidad Total Requerida", "Cantidad Base", "Costo estandar"]:
-    df_exp[col] = pd.to_numeric(df_exp[col], errors="coerce").fillna(0)
-for col in ["Cantidad Base", "T.MO", "T.Maq", "Tarifa MO", "Tarifa Maquina"]:
-    if col in df_tie.columns:
-        df_tie[col] = pd.to_numeric(df_tie[col], errors="coerce").fillna(0)
 
-# ── Funciones de cálculo ────────────────────────────────────
-def es_fabricado(familia):
-    return str(familia).strip().startswith(PREFIJO_FABRIC)
 
-def get_tiempos(codigo, df_t):
-    row = df_t[df_t["Código Semi"] == str(codigo)]
-    return row.iloc[0] if not row.empty else None
+def version_libro(ruta):
+    """Huella del Excel: identifica la versión de los datos."""
+    with open(ruta, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def leer_libro(ruta):
+    """Explosión, Tiempos y Materiales del Excel con columnas y tipos normalizados."""
+    df_exp = pd.read_excel(ruta, sheet_name=HOJA_EXPLOSION)
+    df_tie = pd.read_excel(ruta, sheet_name=HOJA_TIEMPOS)
+    try:
+        df_mat = pd.read_excel(ruta, sheet_name="Materiales")
+        df_mat.columns = df_mat.columns.str.strip()
+        df_mat["Codigo"] = df_mat["Codigo"].astype(str).str.strip()
+        print("✅ Hoja Materiales cargada")
+    except:
+        df_mat = pd.DataFrame(columns=["Codigo","Descripción","UM","TIPO DE COMPRA","MOQ","LT-días","Tipo"])
+        print("⚠️ Hoja Materiales no encontrada, usando vacío")
+
+    df_exp.columns = df_exp.columns.str.strip()
+    df_tie.columns = df_tie.columns.str.strip()
 
-def calcular_semi(codigo_semi, cantidad_req, df_e, df_t, cache, resumen_global, codigo_pt):
-    cache_key = f"{codigo_semi}_{cantidad_req}"
-    if cache_key in cache:
-        return cache[cache_key]["costo_x_und"], []
+    for col in ["Código PT", "Código Semi", "Componente", "Familia"]:
+        if col in df_exp.columns:
+            df_exp[col] = df_exp[col].astype(str).str.strip()
+    df_tie["Código Semi"] = df_tie["Código Semi"].astype(str).str.strip()
 
-    hijos = df_e[(df_e["Código Semi"] == str(codigo_semi)) & (df_e["Código PT"] == str(codigo_pt))].copy()
-    if hijos.empty:
-        return 0, []
+    for col in ["Cantidad Total Requerida", "Cantidad Base", "Costo estandar"]:
+        df_exp[col] = pd.to_numeric(df_exp[col], errors="coerce").fillna(0).astype(float)
+    for col in ["Cantidad Base", "T.MO", "T.Maq", "Tarifa MO", "Tarifa Maquina"]:
+        if col in df_tie.columns:
+            # float: el simulador escribe valores decimales sobre estas columnas
+            df_tie[col] = pd.to_numeric(df_tie[col], errors="coerce").fillna(0).astype(float)
+    return df_exp, df_tie, df_mat
 
-    desc_semi     = hijos["Descripción Semi"].iloc[0] if "Descripción Semi" in hijos.columns else ""
-    t             = get_tiempos(codigo_semi, df_t)
+
+VERSION_DATOS = version_libro(ARCHIVO_DATOS)
+df_exp, df_tie, df_mat = leer_libro(ARCHIVO_DATOS)
+
+# ── Funciones de cálculo ────────────────────────────────────
+def es_fabricado(familia):
+    return str(familia).strip().startswith(PREFIJO_FABRIC)
+
+def cant_base_inyeccion(t_ciclo, cav_oper):
+    """Piezas por día (24 h) de una inyectora: también acepta Series/arrays."""
+    return (3600 / t_ciclo) * cav_oper * 24
+
+def indice_tiempos(df_t):
+    """{Código Semi: primera fila de Tiempos} para búsquedas O(1)."""
+    return df_t.drop_duplicates("Código Semi").set_index("Código Semi").to_dict("index")
+
+
+# ── Validación de la estructura (BOM) ───────────────────────
+# Se recorre la Explosión una sola vez al cargar, sin recursión: se detectan
+# ciclos, semis sin ruta en Tiempos o sin estructura, y se guarda por PT el
+# orden en que deben costearse sus semis. Los cálculos por request solo
+# iteran esas listas.
+SIN_COSTO = -1  # semi fabricado sin estructura o que cierra un ciclo: costo 0
+
+
+def secuencia_filas(raiz, hijos_de, filas):
+    """Filas de la explosión en el orden de un recorrido en profundidad desde
+    la raíz, expandiendo cada semi fabricado una sola vez."""
+    visitados = {raiz}
+    secuencia = []
+    pila      = [iter(hijos_de(raiz))]
+    while pila:
+        for idx in pila[-1]:
+            secuencia.append(idx)
+            comp, fabricado = filas[idx]["Componente"], filas[idx]["Fabricado"]
+            if fabricado and comp not in visitados:
+                visitados.add(comp)
+                pila.append(iter(hijos_de(comp)))
+                break
+        else:
+            pila.pop()
+    return secuencia
+
+
+def planificar_pt(codigo_pt, filas, grupos_semi, grupos_pt):
+    """Plan de costeo del PT: nodos (semi, cantidad) en post-orden, de modo que
+    cada nodo aparece después de todos sus hijos. Cada entrada de un nodo es
+    (fila, nodo hijo o None si es comprado, emitir detalle del hijo)."""
+    raiz_filas = list(grupos_semi.get(codigo_pt, []))
+    nodos, ids, ciclos, sin_estructura = [], {}, [], []
+    raiz  = {"semi": codigo_pt, "filas": raiz_filas, "pos": 0, "entradas": []}
+    pila  = [raiz]
+    camino = {codigo_pt}
+    while pila:
+        marco = pila[-1]
+        if marco["pos"] == len(marco["filas"]):
+            pila.pop()
+            if marco is raiz:
+                continue
+            camino.discard(marco["semi"])
+            key      = (marco["semi"], marco["cant"])
+            ids[key] = len(nodos)
+            nodos.append({"semi": marco["semi"], "cant": marco["cant"],
+                          "desc": filas[marco["filas"][0]]["Descripción Semi"],
+                          "entradas": marco["entradas"]})
+            pila[-1]["entradas"].append((marco["idx_padre"], ids[key], True))
+            continue
+        idx = marco["filas"][marco["pos"]]
+        marco["pos"] += 1
+        fila = filas[idx]
+        comp, cantidad = fila["Componente"], fila["Cantidad"]
+        if not fila["Fabricado"]:
+            marco["entradas"].append((idx, None, False))
+        elif (comp, cantidad) in ids:
+            marco["entradas"].append((idx, ids[(comp, cantidad)], False))
+        elif comp in camino:
+            ciclos.append([f["semi"] for f in pila] + [comp])
+            marco["entradas"].append((idx, SIN_COSTO, False))
+        elif (codigo_pt, comp) not in grupos_pt:
+            sin_estructura.append(comp)
+            marco["entradas"].append((idx, SIN_COSTO, False))
+        else:
+            camino.add(comp)
+            pila.append({"semi": comp, "cant": cantidad, "idx_padre": idx,
+                         "filas": list(grupos_pt[(codigo_pt, comp)]),
+                         "pos": 0, "entradas": []})
+    return {"raiz": raiz["entradas"], "nodos": nodos,
+            "ciclos": ciclos, "sin_estructura": sin_estructura}
+
+
+def niveles_y_orden(plan):
+    """Nivel BOM (camino más largo desde el PT) y orden topológico de semis."""
+    niveles = {}
+    for _, ref, _ in plan["raiz"]:
+        if ref is not None and ref != SIN_COSTO:
+            niveles[ref] = 1
+    for i in reversed(range(len(plan["nodos"]))):
+        for _, ref, _ in plan["nodos"][i]["entradas"]:
+            if ref is not None and ref != SIN_COSTO:
+                niveles[ref] = max(niveles.get(ref, 0), niveles.get(i, 1) + 1)
+    nivel_semi = {}
+    for i in reversed(range(len(plan["nodos"]))):
+        semi = plan["nodos"][i]["semi"]
+        nivel_semi[semi] = max(nivel_semi.get(semi, 0), niveles.get(i, 1))
+    return nivel_semi, list(nivel_semi)
+
+
+def validar_bom(df_e, df_t):
+    filas = {
+        idx: {"Componente": str(r["Componente"]),
+              "Descripción Componente": str(r.get("Descripción Componente", "")),
+              "Descripción Semi": r.get("Descripción Semi", ""),
+              "Cantidad": float(r["Cantidad Total Requerida"]),
+              "Familia": str(r.get("Familia", str(r["Componente"])[:3])).strip(),
+              "Fabricado": es_fabricado(r.get("Familia", str(r["Componente"])[:3]))}
+        for idx, r in zip(df_e.index, df_e.to_dict("records"))
+    }
+    grupos_semi = {k: list(v) for k, v in df_e.groupby("Código Semi", sort=False).groups.items()}
+    grupos_pt   = {k: list(v) for k, v in
+                   df_e.groupby(["Código PT", "Código Semi"], sort=False).groups.items()}
+    tiempos     = indice_tiempos(df_t)
+    descripcion = {f["Componente"]: f["Descripción Componente"] for f in filas.values()}
+
+    planes, secuencias_pt, niveles, ordenes, problemas = {}, {}, {}, {}, []
+    for codigo_pt in df_e["Código PT"].unique():
+        plan = planificar_pt(codigo_pt, filas, grupos_semi, grupos_pt)
+        planes[codigo_pt] = plan
+        secuencias_pt[codigo_pt] = secuencia_filas(
+            codigo_pt, lambda c, pt=codigo_pt: grupos_pt.get((pt, c), []), filas)
+        niveles[codigo_pt], ordenes[codigo_pt] = niveles_y_orden(plan)
+
+        def problema(codigo, texto):
+            problemas.append({"Código PT": codigo_pt, "Código": codigo,
+                              "Descripción": descripcion.get(codigo, ""),
+                              "Nivel": niveles[codigo_pt].get(codigo, 0),
+                              "Problema": texto})
+
+        if codigo_pt not in tiempos:
+            problema(codigo_pt, "PT sin ruta en Tiempos — se asume ENCAJADO sin CIF/MOD")
+        for semi in ordenes[codigo_pt]:
+            if semi not in tiempos:
+                problema(semi, "Sin ruta en Tiempos — CIF y MOD en cero")
+        for semi in dict.fromkeys(plan["sin_estructura"]):
+            problema(semi, "Fabricado sin estructura en Explosión — costo cero")
+        for ciclo in plan["ciclos"]:
+            problema(ciclo[-1], "Ciclo en la estructura: " + " → ".join(ciclo))
+
+    return {"filas": filas, "planes": planes, "secuencias_pt": secuencias_pt,
+            "niveles": niveles, "orden": ordenes, "problemas": problemas}
+
+
+def calcular_semi(nodo, costos, detalles, costo_std, filas, tiempos, resumen_global):
+    """Costea un nodo del plan; sus hijos ya están en `costos` y `detalles`."""
+    codigo_semi   = nodo["semi"]
+    cantidad_req  = nodo["cant"]
+    desc_semi     = nodo["desc"]
+    t             = tiempos.get(codigo_semi)
     proceso       = str(t["Proceso"]).strip().upper() if t is not None else "SIN PROCESO"
     cant_base_t   = float(t["Cantidad Base"])          if t is not None else 1
     tarifa_maq    = float(t["Tarifa Maquina"])         if t is not None else 0
@@ -88,27 +255,27 @@ def calcular_semi(codigo_semi, cantidad_req, df_e, df_t, cache, resumen_global,
     cm_total     = 0
     cm_comprados = 0
 
-    for _, row in hijos.iterrows():
-        componente = str(row["Componente"])
-        desc_comp  = str(row.get("Descripción Componente", ""))
-        cantidad   = float(row["Cantidad Total Requerida"])
-        costo_std  = float(row["Costo estandar"])
-        familia    = str(row.get("Familia", componente[:3])).strip()
+    for idx, ref, emitir in nodo["entradas"]:
+        fila       = filas[idx]
+        componente = fila["Componente"]
+        cantidad   = fila["Cantidad"]
+        familia    = fila["Familia"]
 
-        if es_fabricado(familia):
-            costo_calc, sub_det = calcular_semi(componente, cantidad, df_e, df_t, cache, resumen_global, codigo_pt)
-            detalle.extend(sub_det)
+        if fila["Fabricado"]:
+            costo_calc = costos[ref] if ref != SIN_COSTO else 0
+            if emitir:
+                detalle.extend(detalles[ref])
             cm_comp = cantidad * costo_calc
         else:
-            costo_calc   = costo_std
+            costo_calc   = float(costo_std[idx])
             cm_comp      = cantidad * costo_calc
             cm_comprados += cm_comp
 
         cm_total += cm_comp
         detalle.append({
             "Código Semi": codigo_semi, "Descripción Semi": desc_semi,
-            "Componente": componente,   "Descripción Componente": desc_comp,
-            "Familia": familia, "Tipo": "FABRICADO" if es_fabricado(familia) else "COMPRADO",
+            "Componente": componente,   "Descripción Componente": fila["Descripción Componente"],
+            "Familia": familia, "Tipo": "FABRICADO" if fila["Fabricado"] else "COMPRADO",
             "Proceso": proceso, "Cantidad Total Req": cantidad,
             "Costo Calculado": costo_calc, "CM": cm_comp,
             "CIF": 0, "MOD": 0, "Total": cm_comp,
@@ -133,21 +300,30 @@ def calcular_semi(codigo_semi, cantidad_req, df_e, df_t, cache, resumen_global,
         "CM": cm_total, "CIF": cif, "MOD": mod, "Total": cm_total + cif + mod,
     })
 
-    cache[cache_key] = {"costo_x_und": costo_x_und}
-    return costo_x_und, detalle
+    costos.append(costo_x_und)
+    detalles.append(detalle)
 
 
-def explotar_pt(codigo_pt, df_e, df_t):
-    nivel1 = df_e[df_e["Código Semi"] == str(codigo_pt)].copy()
-    if nivel1.empty:
+def explotar_pt(codigo_pt, df_e, df_t, validacion=None, tiempos=None, costo_std=None):
+    """Costea el PT recorriendo su plan validado. `df_e` y `df_t` pueden ser
+    copias simuladas: solo se leen precios y tiempos, la estructura sale del plan.
+    `tiempos` y `costo_std` reciben índices ya armados (p. ej. con el delta de
+    un escenario superpuesto) en lugar de derivarlos de `df_t` y `df_e`."""
+    validacion = validacion or VALIDACION
+    plan       = validacion["planes"].get(str(codigo_pt))
+    if plan is None or not plan["raiz"]:
         return {}, [], 0
+    filas     = validacion["filas"]
+    costo_std = df_e["Costo estandar"] if costo_std is None else costo_std
+    tiempos   = indice_tiempos(df_t)   if tiempos   is None else tiempos
 
-    cant_base_pt = float(nivel1["Cantidad Base"].iloc[0])
+    idx_raiz     = plan["raiz"][0][0]
+    cant_base_pt = float(df_e.at[idx_raiz, "Cantidad Base"])
     if cant_base_pt == 0:
         cant_base_pt = 1
-    desc_pt = nivel1["Descripción Semi"].iloc[0] if "Descripción Semi" in nivel1.columns else ""
+    desc_pt = filas[idx_raiz]["Descripción Semi"]
 
-    t           = get_tiempos(codigo_pt, df_t)
+    t           = tiempos.get(codigo_pt)
     proceso_pt  = str(t["Proceso"]).strip().upper() if t is not None else "ENCAJADO"
     cant_base_t = float(t["Cantidad Base"])          if t is not None else 1
     tarifa_maq  = float(t["Tarifa Maquina"])         if t is not None else 0
@@ -160,33 +336,37 @@ def explotar_pt(codigo_pt, df_e, df_t):
     cif_pt = (t_maq / cant_base_t) * cant_base_pt * tarifa_maq
     mod_pt = (t_mo  / cant_base_t) * cant_base_pt * tarifa_mo
 
-    cache          = {}
+    costos         = []
+    detalles       = []
     detalle        = []
     resumen_global = {}
     cm_total       = 0
     cm_comprados   = 0
 
-    for _, row in nivel1.iterrows():
-        componente = str(row["Componente"])
-        desc_comp  = str(row.get("Descripción Componente", ""))
-        cantidad   = float(row["Cantidad Total Requerida"])
-        costo_std  = float(row["Costo estandar"])
-        familia    = str(row.get("Familia", componente[:3])).strip()
+    for nodo in plan["nodos"]:
+        calcular_semi(nodo, costos, detalles, costo_std, filas, tiempos, resumen_global)
 
-        if es_fabricado(familia):
-            costo_calc, sub_det = calcular_semi(componente, cantidad, df_e, df_t, cache, resumen_global, codigo_pt)
-            detalle.extend(sub_det)
+    for idx, ref, emitir in plan["raiz"]:
+        fila       = filas[idx]
+        componente = fila["Componente"]
+        cantidad   = fila["Cantidad"]
+        familia    = fila["Familia"]
+
+        if fila["Fabricado"]:
+            costo_calc = costos[ref] if ref != SIN_COSTO else 0
+            if emitir:
+                detalle.extend(detalles[ref])
             cm_comp = cantidad * costo_calc
         else:
-            costo_calc   = costo_std
+            costo_calc   = float(costo_std[idx])
             cm_comp      = cantidad * costo_calc
             cm_comprados += cm_comp
 
         cm_total += cm_comp
         detalle.append({
             "Código Semi": codigo_pt, "Descripción Semi": desc_pt,
-            "Componente": componente, "Descripción Componente": desc_comp,
-            "Familia": familia, "Tipo": "FABRICADO" if es_fabricado(familia) else "COMPRADO",
+            "Componente": componente, "Descripción Componente": fila["Descripción Componente"],
+            "Familia": familia, "Tipo": "FABRICADO" if fila["Fabricado"] else "COMPRADO",
             "Proceso": proceso_pt, "Cantidad Total Req": cantidad,
             "Costo Calculado": costo_calc, "CM": cm_comp,
             "CIF": 0, "MOD": 0, "Total": cm_comp,
@@ -203,17 +383,26 @@ def explotar_pt(codigo_pt, df_e, df_t):
     return resumen_global, detalle, costo_x_und
 
 
+VALIDACION = validar_bom(df_exp, df_tie)
+TIEMPOS    = indice_tiempos(df_tie)
+if VALIDACION["problemas"]:
+    print(f"⚠️ Validación BOM: {len(VALIDACION['problemas'])} observación(es)")
+else:
+    print("✅ Validación BOM sin observaciones")
+
+
 # ── Generar resumen global ──────────────────────────────────
 lista_pt      = df_exp["Código PT"].unique()
 filas_resumen = []
-filas_detalle = []
+COSTOS_BASE   = {}  # codigo_pt -> (resumen por proceso, costo_x_und) del dataset
 
 for codigo_pt in lista_pt:
     df_pt_rows = df_exp[df_exp["Código PT"] == codigo_pt]
     if df_pt_rows.empty:
         continue
     desc_pt = df_pt_rows["Descripción PT"].iloc[0]
-    resumen, detalle, _ = explotar_pt(codigo_pt, df_exp, df_tie)
+    resumen, _, costo_x_und = explotar_pt(codigo_pt, df_exp, df_tie, tiempos=TIEMPOS)
+    COSTOS_BASE[codigo_pt] = (resumen, costo_x_und)
     total_general = sum(v["CM"] + v["CIF"] + v["MOD"] for v in resumen.values())
     if total_general == 0:
         continue
@@ -229,19 +418,22 @@ for codigo_pt in lista_pt:
                     "Proceso": proceso, "Tipo de Costo": f"{tipo} {proceso}",
                     "Costo Unitario": monto / cant_base_pt, "Total PT": total_general,
                 })
-    for d in detalle:
-        d["Código PT"]      = codigo_pt
-        d["Descripción PT"] = desc_pt
-        filas_detalle.append(d)
 
 df_resumen = pd.DataFrame(filas_resumen)
-df_detalle = pd.DataFrame(filas_detalle)
 if not df_resumen.empty:
     df_resumen["% del Total"] = (
         df_resumen["Costo Unitario"] /
         df_resumen.groupby("Código PT")["Costo Unitario"].transform("sum")
     )
 
+# ── Historial de versiones ──────────────────────────────────
+if INGRESAR_HISTORIAL:
+    try:
+        if historial_costos.ingresar_si_nueva(ARCHIVO_DATOS, sys.modules[__name__]):
+            print("✅ Versión del Excel agregada al historial")
+    except Exception as e:
+        print(f"⚠️ No se pudo actualizar el historial: {e}")
+
 # ── Dashboard ───────────────────────────────────────────────
 app    = Dash(__name__)
 server = app.server  # Necesario para Render/gunicorn
@@ -255,54 +447,138 @@ COLORES = {
 lista_pt_dd = df_resumen[["Código PT", "Descripción PT"]].drop_duplicates()
 
 
+# ── Búsqueda de PT ──────────────────────────────────────────
+# El selector no lleva el catálogo completo: cada tecla consulta este índice
+# (trigramas para subcadenas, prefijos para 1-2 letras) y devuelve las
+# mejores MAX_OPCIONES_PT coincidencias.
+MAX_OPCIONES_PT = 20
+
+
+def normalizar_texto(texto):
+    """Minúsculas y sin tildes, para que "temperas" encuentre "Témperas"."""
+    sin_tildes = unicodedata.normalize("NFKD", str(texto)).encode("ascii", "ignore").decode()
+    return " ".join(sin_tildes.lower().split())
+
+
+def construir_indice_pt(catalogo):
+    catalogo = catalogo.sort_values("Código PT")  # posición == orden por código
+    entradas, trigramas, prefijos = [], {}, {}
+    for i, (codigo, desc) in enumerate(zip(catalogo["Código PT"], catalogo["Descripción PT"])):
+        label = f"{codigo} — {desc}"
+        texto = normalizar_texto(f"{codigo} {desc}")
+        entradas.append({"codigo": codigo, "label": label, "texto": texto,
+                         "palabras": texto.split()})
+        for k in range(len(texto) - 2):
+            trigramas.setdefault(texto[k:k + 3], set()).add(i)
+        for palabra in texto.split():
+            for n in (1, 2):
+                lista = prefijos.setdefault(palabra[:n], [])
+                if not lista or lista[-1] != i:  # listas ya ordenadas por código
+                    lista.append(i)
+    return {"entradas": entradas, "codigos": [e["codigo"].lower() for e in entradas],
+            "trigramas": trigramas, "prefijos": prefijos}
+
+
+def buscar_pt(consulta, indice=None, limite=MAX_OPCIONES_PT):
+    """Códigos de PT que contienen la consulta, por niveles: primero los que
+    empiezan por ella, luego los que tienen una palabra que empieza por ella
+    y al final el resto; dentro de cada nivel, por código. Se corta apenas
+    hay `limite` resultados. Con menos de 3 caracteres la descripción solo se
+    busca por inicio de palabra; el código sí se busca en cualquier posición."""
+    indice   = indice or INDICE_PT
+    entradas = indice["entradas"]
+    q        = normalizar_texto(consulta)
+    if not q:
+        return [e["codigo"] for e in entradas[:limite]]
+
+    # Nivel 0: el código empieza por la consulta (rango contiguo, por bisección)
+    desde = bisect.bisect_left(indice["codigos"], q)
+    hasta = bisect.bisect_left(indice["codigos"], q + "\uffff")
+    elegidos = list(range(desde, min(hasta, desde + limite)))
+    if len(elegidos) == limite:
+        return [entradas[i]["codigo"] for i in elegidos]
+
+    if len(q) < 3:
+        # Sin trigramas: prefijos de palabra, luego un barrido de los códigos
+        por_palabra = indice["prefijos"].get(q, [])
+        en_texto    = (i for i, c in enumerate(indice["codigos"]) if q in c)
+    else:
+        grupos = sorted((indice["trigramas"].get(q[k:k + 3], set())
+                         for k in range(len(q) - 2)), key=len)
+        candidatos  = sorted(set(grupos[0]).intersection(*grupos[1:]))
+        por_palabra = (i for i in candidatos
+                       if any(p.startswith(q) for p in entradas[i]["palabras"]))
+        en_texto    = (i for i in candidatos if q in entradas[i]["texto"])
+
+    vistos = set(range(desde, hasta))
+    for i in itertools.chain(por_palabra, en_texto):
+        if i not in vistos:
+            vistos.add(i)
+            elegidos.append(i)
+            if len(elegidos) == limite:
+                break
+    return [entradas[i]["codigo"] for i in elegidos]
+
+
+def opcion_pt(codigo):
+    e = INDICE_PT["entradas"][POSICION_PT[codigo]]
+    # `search` incluye el texto normalizado para que el filtro del navegador
+    # no oculte coincidencias sin tildes que ya resolvió el servidor
+    return {"label": e["label"], "value": codigo, "search": f"{e['label']} {e['texto']}"}
+
+
+def opciones_pt_iniciales(codigo_pt):
+    """Opciones con que arranca el selector: los primeros PT por código y el
+    PT elegido, para poder abrir la lista sin escribir."""
+    codigos = buscar_pt("")
+    if codigo_pt in POSICION_PT and codigo_pt not in codigos:
+        codigos = [codigo_pt] + codigos
+    return [opcion_pt(c) for c in codigos]
+
+
+INDICE_PT   = construir_indice_pt(lista_pt_dd)
+POSICION_PT = {e["codigo"]: i for i, e in enumerate(INDICE_PT["entradas"])}
+PT_INICIAL  = lista_pt_dd["Código PT"].iloc[0]
+
+
+def secuencia_pt(codigo_pt):
+    """Filas de la explosión del PT en el orden del recorrido validado."""
+    return VALIDACION["secuencias_pt"].get(str(codigo_pt), [])
+
+
 def get_maquinas_inyeccion(codigo_pt):
     """Máquinas de INYECCIÓN con T.Ciclo y Cav.Oper editables."""
-    visitados = set()
     maquinas  = {}
-
-    def buscar(codigo):
-        if codigo in visitados:
-            return
-        visitados.add(codigo)
-        hijos = df_exp[df_exp["Código Semi"] == codigo]
-        for _, row in hijos.iterrows():
-            comp    = str(row["Componente"])
-            familia = str(row.get("Familia", comp[:3])).strip()
-            t       = df_tie[df_tie["Código Semi"] == comp]
-            if not t.empty:
-                proc = str(t.iloc[0].get("Proceso", "")).strip().upper()
-                if "INYEC" in proc:
-                    t_row = t.iloc[0]
-                    maq   = str(t_row.get("Maquina", comp))
-                    if maq not in maquinas:
-                        maquinas[maq] = {
-                            "Maquina":   maq,
-                            "T.Ciclo":   float(t_row.get("T.ciclo",        0) or 0),
-                            "Cav.Oper":  float(t_row.get("Cav. Oper",      0) or 0),
-                            "Cav.Tot":   float(t_row.get("Cav. Tot",       0) or 0),
-                            "Tarifa Maq":float(t_row.get("Tarifa Maquina", 0) or 0),
-                            "Tarifa MO": float(t_row.get("Tarifa MO",      0) or 0),
-                        }
-            if familia.startswith("231"):
-                buscar(comp)
-
-    buscar(codigo_pt)
+    for idx in secuencia_pt(codigo_pt):
+        comp  = VALIDACION["filas"][idx]["Componente"]
+        t_row = TIEMPOS.get(comp)
+        if t_row is not None:
+            proc = str(t_row.get("Proceso", "")).strip().upper()
+            if "INYEC" in proc:
+                maq   = str(t_row.get("Maquina", comp))
+                if maq not in maquinas:
+                    maquinas[maq] = {
+                        "Maquina":   maq,
+                        "T.Ciclo":   float(t_row.get("T.ciclo",        0) or 0),
+                        "Cav.Oper":  float(t_row.get("Cav. Oper",      0) or 0),
+                        "Cav.Tot":   float(t_row.get("Cav. Tot",       0) or 0),
+                        "Tarifa Maq":float(t_row.get("Tarifa Maquina", 0) or 0),
+                        "Tarifa MO": float(t_row.get("Tarifa MO",      0) or 0),
+                    }
     return list(maquinas.values())
 
 
 def get_semis_otros_procesos(codigo_pt):
     """Otros procesos agrupados por máquina — incluye PT (ENCAJADO) y semis."""
-    visitados  = set()
     maquinas   = {}
     excluidos  = ["INYEC", "MYT", "M&T", "MASAS"]
 
     def agregar_si_aplica(codigo):
         """Agrega el código a la tabla si su proceso no está excluido."""
-        t = df_tie[df_tie["Código Semi"] == codigo]
-        if not t.empty:
-            proc = str(t.iloc[0].get("Proceso", "")).strip().upper()
+        t_row = TIEMPOS.get(codigo)
+        if t_row is not None:
+            proc = str(t_row.get("Proceso", "")).strip().upper()
             if not any(ex in proc for ex in excluidos) and proc != "SIN PROCESO":
-                t_row = t.iloc[0]
                 maq   = str(t_row.get("Maquina", codigo))
                 key   = f"{proc}_{maq}"
                 if key not in maquinas:
@@ -317,211 +593,20 @@ def get_semis_otros_procesos(codigo_pt):
                         "Tarifa MO":    float(t_row.get("Tarifa MO",     0) or 0),
                     }
 
-    def buscar(codigo):
-        if codigo in visitados:
-            return
-        visitados.add(codigo)
-        # Verificar el propio código (para capturar ENCAJADO del PT)
-        agregar_si_aplica(codigo)
-        hijos = df_exp[df_exp["Código Semi"] == codigo]
-        for _, row in hijos.iterrows():
-            comp    = str(row["Componente"])
-            familia = str(row.get("Familia", comp[:3])).strip()
-            agregar_si_aplica(comp)
-            if familia.startswith("231"):
-                buscar(comp)
-
-    buscar(codigo_pt)
+    # Verificar el propio código (para capturar ENCAJADO del PT)
+    agregar_si_aplica(str(codigo_pt))
+    for idx in secuencia_pt(codigo_pt):
+        agregar_si_aplica(VALIDACION["filas"][idx]["Componente"])
     return list(maquinas.values())
 
 
-app.layout = html.Div(
-    style={"backgroundColor": COLORES["bg"], "minHeight": "100vh",
-           "fontFamily": "'Segoe UI', sans-serif",
-           "color": COLORES["text"], "padding": "20px"},
-    children=[
-        html.H1("📦 Reporte de Costos por Proceso",
-                style={"color": COLORES["accent"], "textAlign": "center", "marginBottom": "5px"}),
-        html.P(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
-               style={"color": "#7A9BBF", "textAlign": "center", "marginBottom": "25px"}),
-
-        html.Div(style={"marginBottom": "25px"}, children=[
-            html.Label("Selecciona un Producto Terminado:",
-                       style={"color": COLORES["accent"], "fontWeight": "bold"}),
-            dcc.Dropdown(
-                id="selector-pt",
-                options=[{"label": f"{r['Código PT']} — {r['Descripción PT']}",
-                          "value": r["Código PT"]}
-                         for _, r in lista_pt_dd.iterrows()],
-                value=lista_pt_dd["Código PT"].iloc[0],
-                style={"marginTop": "8px", "color": "#000"}
-            ),
-        ]),
-
-        html.Div(id="kpis", style={"display": "flex", "gap": "15px",
-                                    "marginBottom": "25px", "flexWrap": "wrap"}),
-
-        # Simulador
-        html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
-                        "padding": "15px", "marginBottom": "20px",
-                        "border": "1px solid #00C8FF"}, children=[
-            html.H3("🔧 Simulador de Inyección — Modifica T.Ciclo y Cav.Oper por Máquina",
-                    style={"color": COLORES["accent"], "fontSize": "16px",
-                           "marginTop": 0, "marginBottom": "10px"}),
-            html.P("Edita los valores en la tabla y presiona Recalcular.",
-                   style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
-            dash_table.DataTable(
-                id="tabla-simulador",
-                columns=[
-                    {"name": "Máquina",        "id": "Maquina",    "editable": False},
-                    {"name": "T.Ciclo (s)",    "id": "T.Ciclo",    "editable": True,  "type": "numeric"},
-                    {"name": "Cav.Oper",       "id": "Cav.Oper",   "editable": True,  "type": "numeric"},
-                    {"name": "Cav.Tot",        "id": "Cav.Tot",    "editable": False},
-                    {"name": "Cant.Base Calc", "id": "Cant.Base",  "editable": False},
-                    {"name": "Tarifa Maq",     "id": "Tarifa Maq", "editable": False},
-                    {"name": "Tarifa MO",      "id": "Tarifa MO",  "editable": False},
-                ],
-                style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
-                style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
-                            "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
-                style_data_conditional=[
-                    {"if": {"column_editable": True},
-                     "backgroundColor": "#0D2137", "border": "1px solid #00C8FF"},
-                    {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
-                ],
-                editable=True, page_action="none",
-            ),
-        ]),
-
-        # Botón recalcular — aplica a AMBOS simuladores
-        html.Div(style={"textAlign": "center", "margin": "15px 0"}, children=[
-            html.Button("🔄 Recalcular Todos los Procesos", id="btn-recalcular",
-                style={"backgroundColor": COLORES["accent"], "color": "#000",
-                       "fontWeight": "bold", "border": "none", "borderRadius": "8px",
-                       "padding": "12px 40px", "cursor": "pointer", "fontSize": "15px",
-                       "boxShadow": "0 0 15px rgba(0,200,255,0.4)"}),
-            html.Div(id="msg-simulador",
-                     style={"color": "#4CAF50", "fontSize": "13px", "marginTop": "8px"}),
-        ]),
-
-        # Simulador otros procesos
-        html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
-                        "padding": "15px", "marginBottom": "20px",
-                        "border": "1px solid #4CAF50"}, children=[
-            html.H3("⚙️ Simulador Otros Procesos — Modifica Cantidad Base, T.MO, T.Maq",
-                    style={"color": "#4CAF50", "fontSize": "16px",
-                           "marginTop": 0, "marginBottom": "10px"}),
-            html.P("Edita los valores y presiona Recalcular para ver el impacto.",
-                   style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
-            dash_table.DataTable(
-                id="tabla-simulador-otros",
-                columns=[
-                    {"name": "Proceso",        "id": "Proceso",       "editable": False},
-                    {"name": "Máquina",        "id": "Maquina",       "editable": False},
-                    {"name": "Cantidad Base",  "id": "Cantidad Base", "editable": True,  "type": "numeric"},
-                    {"name": "T.MO",           "id": "T.MO",          "editable": True,  "type": "numeric"},
-                    {"name": "T.Maq",          "id": "T.Maq",         "editable": True,  "type": "numeric"},
-                    {"name": "Cant.Opr",       "id": "Cant.Opr",      "editable": False},
-                    {"name": "Tarifa Maq",     "id": "Tarifa Maq",    "editable": False},
-                    {"name": "Tarifa MO",      "id": "Tarifa MO",     "editable": False},
-                ],
-                style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
-                style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
-                            "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
-                style_data_conditional=[
-                    {"if": {"column_editable": True},
-                     "backgroundColor": "#0D2137", "border": "1px solid #4CAF50"},
-                    {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
-                ],
-                editable=True, page_action="none",
-            ),
-        ]),
-
-        html.Div(style={"display": "grid", "gridTemplateColumns": "1fr 1fr",
-                        "gap": "20px", "marginBottom": "20px"}, children=[
-            html.Div(style={"backgroundColor": COLORES["card"],
-                            "borderRadius": "12px", "padding": "15px"}, children=[
-                html.H3("Cascada de Costos (S/)", style={"color": COLORES["accent"],
-                        "fontSize": "16px", "marginTop": 0}),
-                dcc.Graph(id="grafico-cascada")
-            ]),
-            html.Div(style={"backgroundColor": COLORES["card"],
-                            "borderRadius": "12px", "padding": "15px"}, children=[
-                html.H3("Cascada de Costos (%)", style={"color": COLORES["accent"],
-                        "fontSize": "16px", "marginTop": 0}),
-                dcc.Graph(id="grafico-cascada-pct")
-            ]),
-        ]),
-
-        html.Div(style={"display": "grid", "gridTemplateColumns": "1fr 1fr",
-                        "gap": "20px", "marginBottom": "20px"}, children=[
-            html.Div(style={"backgroundColor": COLORES["card"],
-                            "borderRadius": "12px", "padding": "15px"}, children=[
-                html.H3("Costo por Proceso (%)", style={"color": COLORES["accent"],
-                        "fontSize": "16px", "marginTop": 0}),
-                dcc.Graph(id="grafico-donut")
-            ]),
-            html.Div(style={"backgroundColor": COLORES["card"],
-                            "borderRadius": "12px", "padding": "15px"}, children=[
-                html.H3("Costo por Proceso (S/)", style={"color": COLORES["accent"],
-                        "fontSize": "16px", "marginTop": 0}),
-                dcc.Graph(id="grafico-donut-soles")
-            ]),
-        ]),
-
-        # ── Pareto reemplaza tabla resumen ────────────────────
-        html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
-                        "padding": "15px", "marginBottom": "20px"}, children=[
-            html.H3("📊 Pareto de Costos por Tipo",
-                    style={"color": COLORES["accent"], "fontSize": "16px", "marginTop": 0}),
-            dcc.Graph(id="grafico-pareto")
-        ]),
-
-        # ── Materiales comprados reemplaza detalle componentes ──
-        html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
-                        "padding": "15px"}, children=[
-            html.H3("🛒 Materiales Comprados — Precio Editable para Simular",
-                    style={"color": "#4CAF50", "fontSize": "16px", "marginTop": 0}),
-            html.P("Modifica el precio de cualquier material y presiona Recalcular.",
-                   style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
-            dash_table.DataTable(
-                id="tabla-materiales",
-                columns=[
-                    {"name": "Tipo",           "id": "Tipo",           "editable": False},
-                    {"name": "Componente",      "id": "Componente",     "editable": False},
-                    {"name": "Descripción",     "id": "Descripción",    "editable": False},
-                    {"name": "Precio (S/)",     "id": "Precio",         "editable": True, "type": "numeric"},
-                    {"name": "Tipo de Compra",  "id": "Tipo de Compra", "editable": False},
-                    {"name": "MOQ",             "id": "MOQ",            "editable": False},
-                    {"name": "LT-días",         "id": "LT-días",        "editable": False},
-                ],
-                style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
-                style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
-                            "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
-                style_data_conditional=[
-                    {"if": {"column_editable": True},
-                     "backgroundColor": "#0D2137", "border": "1px solid #4CAF50"},
-                    {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
-                ],
-                editable=True, page_size=20,
-                filter_action="native", sort_action="native",
-            )
-        ]),
-    ]
-)
-
-
-@app.callback(
-    Output("tabla-simulador", "data"),
-    Output("tabla-simulador-otros", "data"),
-    Input("selector-pt", "value"),
-)
-def cargar_simuladores(codigo_pt):
+def filas_simuladores(codigo_pt):
+    """Filas base de los simuladores de inyección y otros procesos del PT."""
     # Inyección
     maquinas = get_maquinas_inyeccion(codigo_pt)
     rows_iny = []
     for m in maquinas:
-        cant_base = round((3600 / m["T.Ciclo"]) * m["Cav.Oper"] * 24, 2)                     if m["T.Ciclo"] > 0 else 0
+        cant_base = round(cant_base_inyeccion(m["T.Ciclo"], m["Cav.Oper"]), 2)                     if m["T.Ciclo"] > 0 else 0
         rows_iny.append({
             "Maquina":   m["Maquina"],   "T.Ciclo":   m["T.Ciclo"],
             "Cav.Oper":  m["Cav.Oper"],  "Cav.Tot":   m["Cav.Tot"],
@@ -545,63 +630,36 @@ def cargar_simuladores(codigo_pt):
     return rows_iny, rows_otros
 
 
-@app.callback(
-    Output("tabla-materiales", "data"),
-    Input("selector-pt", "value"),
-)
-def cargar_materiales(codigo_pt):
-    """Carga todos los materiales COMPRADOS del PT en todos los niveles."""
-    visitados = set()
-    materiales = {}  # key=componente para evitar duplicados
+MATERIALES = df_mat.drop_duplicates("Codigo").set_index("Codigo").to_dict("index")
 
-    def buscar(codigo):
-        if codigo in visitados:
-            return
-        visitados.add(codigo)
-        hijos = df_exp[(df_exp["Código Semi"] == codigo) &
-                       (df_exp["Código PT"] == codigo_pt)]
-        for _, row in hijos.iterrows():
-            comp    = str(row["Componente"])
-            familia = str(row.get("Familia", comp[:3])).strip()
-            if not es_fabricado(familia):
-                if comp not in materiales:
-                    # Cruzar con hoja Materiales
-                    mat_row = df_mat[df_mat["Codigo"] == comp]
-                    tipo_compra = str(mat_row["TIPO DE COMPRA"].iloc[0]) if not mat_row.empty and "TIPO DE COMPRA" in mat_row.columns else ""
-                    moq         = mat_row["MOQ"].iloc[0]    if not mat_row.empty and "MOQ" in mat_row.columns else ""
-                    lt_dias     = mat_row["LT-días"].iloc[0] if not mat_row.empty and "LT-días" in mat_row.columns else ""
-                    tipo        = str(mat_row["Tipo"].iloc[0]) if not mat_row.empty and "Tipo" in mat_row.columns else ""
-                    materiales[comp] = {
-                        "Tipo":          tipo,
-                        "Componente":    comp,
-                        "Descripción":   str(row.get("Descripción Componente", "")),
-                        "Precio":        float(row.get("Costo estandar", 0)),
-                        "Tipo de Compra":tipo_compra,
-                        "MOQ":           moq,
-                        "LT-días":       lt_dias,
-                    }
-            if es_fabricado(familia):
-                buscar(comp)
 
-    buscar(codigo_pt)
+def filas_materiales(codigo_pt):
+    """Todos los materiales COMPRADOS del PT en todos los niveles."""
+    materiales = {}  # key=componente para evitar duplicados
+    for idx in secuencia_pt(codigo_pt):
+        fila = VALIDACION["filas"][idx]
+        comp = fila["Componente"]
+        if not fila["Fabricado"] and comp not in materiales:
+            # Cruzar con hoja Materiales
+            mat_row = MATERIALES.get(comp, {})
+            tipo_compra = str(mat_row["TIPO DE COMPRA"]) if "TIPO DE COMPRA" in mat_row else ""
+            moq         = mat_row.get("MOQ", "")
+            lt_dias     = mat_row.get("LT-días", "")
+            tipo        = str(mat_row["Tipo"]) if "Tipo" in mat_row else ""
+            materiales[comp] = {
+                "Tipo":          tipo,
+                "Componente":    comp,
+                "Descripción":   fila["Descripción Componente"],
+                "Precio":        float(df_exp.at[idx, "Costo estandar"]),
+                "Tipo de Compra":tipo_compra,
+                "MOQ":           moq,
+                "LT-días":       lt_dias,
+            }
     return sorted(materiales.values(), key=lambda x: x["Tipo"])
 
 
-@app.callback(
-    Output("kpis",                "children"),
-    Output("grafico-cascada",     "figure"),
-    Output("grafico-cascada-pct", "figure"),
-    Output("grafico-donut",       "figure"),
-    Output("grafico-donut-soles", "figure"),
-    Output("grafico-pareto",      "figure"),
-    Output("msg-simulador",       "children"),
-    Input("selector-pt",          "value"),
-    Input("btn-recalcular",       "n_clicks"),
-    State("tabla-simulador",      "data"),
-    State("tabla-simulador-otros","data"),
-    State("tabla-materiales",     "data"),
-)
-def actualizar(codigo_pt, n_clicks, datos_simulador, datos_otros, datos_materiales):
+def aplicar_simulacion(datos_simulador, datos_otros, datos_materiales):
+    """Copias de Explosión y Tiempos con los valores de los simuladores aplicados."""
     df_tie_sim = df_tie.copy()
     # Aplicar cambios de inyección por máquina
     if datos_simulador:
@@ -610,7 +668,7 @@ def actualizar(codigo_pt, n_clicks, datos_simulador, datos_otros, datos_material
             t_ciclo  = float(row.get("T.Ciclo", 0) or 0)
             cav_oper = float(row.get("Cav.Oper", 0) or 0)
             if t_ciclo > 0 and cav_oper > 0 and maquina:
-                nueva_base = (3600 / t_ciclo) * cav_oper * 24
+                nueva_base = cant_base_inyeccion(t_ciclo, cav_oper)
                 mask = df_tie_sim["Maquina"].astype(str).str.strip() == maquina
                 df_tie_sim.loc[mask, "Cantidad Base"] = nueva_base
     # Aplicar cambios de otros procesos por máquina
@@ -636,15 +694,928 @@ def actualizar(codigo_pt, n_clicks, datos_simulador, datos_otros, datos_material
             if comp and precio > 0:
                 mask = df_exp_sim["Componente"] == comp
                 df_exp_sim.loc[mask, "Costo estandar"] = precio
+    return df_exp_sim, df_tie_sim
+
+
+# ── Escenarios guardados (SQLite) ───────────────────────────
+# Un escenario es un delta compacto contra VERSION_DATOS: solo guarda los
+# campos editados de cada tabla del simulador, por máquina o componente.
+#   {"iny":     {maquina: {"T.Ciclo": v, "Cav.Oper": v}},
+#    "otros":   {maquina: {"Cantidad Base": v, "T.MO": v, "T.Maq": v}},
+#    "precios": {componente: {"Precio": v}}}
+CAMPOS_DELTA = {
+    "iny":     ("tabla-simulador",       "Maquina",    ["T.Ciclo", "Cav.Oper"]),
+    "otros":   ("tabla-simulador-otros", "Maquina",    ["Cantidad Base", "T.MO", "T.Maq"]),
+    "precios": ("tabla-materiales",      "Componente", ["Precio"]),
+}
+
+_cache_tablas = {}  # codigo_pt -> {"iny": [...], "otros": [...], "precios": [...]}
+
+# Índices para superponer un delta sin copiar Explosión ni Tiempos
+COSTO_STD        = df_exp["Costo estandar"].to_dict()  # fila -> precio
+FILAS_COMPONENTE = {k: list(v) for k, v in df_exp.groupby("Componente", sort=False).groups.items()}
+SEMIS_MAQUINA    = (df_tie.drop_duplicates("Código Semi")  # máquina -> códigos que la usan
+                    .groupby(df_tie["Maquina"].astype(str).str.strip())["Código Semi"]
+                    .agg(list).to_dict())
+
+
+def init_escenarios():
+    with closing(sqlite3.connect(ARCHIVO_ESCENARIOS)) as con, con:
+        con.execute("""CREATE TABLE IF NOT EXISTS escenarios (
+                           nombre        TEXT PRIMARY KEY,
+                           version_datos TEXT NOT NULL,
+                           delta         TEXT NOT NULL,
+                           actualizado   TEXT NOT NULL)""")
+
+
+def guardar_escenario(nombre, delta):
+    with closing(sqlite3.connect(ARCHIVO_ESCENARIOS)) as con, con:
+        con.execute("INSERT OR REPLACE INTO escenarios VALUES (?, ?, ?, ?)",
+                    (nombre, VERSION_DATOS, json.dumps(delta, sort_keys=True),
+                     datetime.now().isoformat(timespec="seconds")))
+
+
+def leer_escenario(nombre):
+    """Delta del escenario guardado, o vacío si no existe / es la base."""
+    if not nombre:
+        return {}
+    with closing(sqlite3.connect(ARCHIVO_ESCENARIOS)) as con:
+        fila = con.execute("SELECT delta FROM escenarios WHERE nombre = ?",
+                           (nombre,)).fetchone()
+    return json.loads(fila[0]) if fila else {}
+
+
+def listar_escenarios():
+    with closing(sqlite3.connect(ARCHIVO_ESCENARIOS)) as con:
+        filas = con.execute("SELECT nombre, version_datos FROM escenarios "
+                            "ORDER BY nombre").fetchall()
+    return [{"label": nombre if version == VERSION_DATOS else f"{nombre} (otra versión)",
+             "value": nombre}
+            for nombre, version in filas]
+
+
+def tablas_base(codigo_pt):
+    """Filas sin editar de las tres tablas del simulador para el PT (memoizado)."""
+    if codigo_pt not in _cache_tablas:
+        rows_iny, rows_otros = filas_simuladores(codigo_pt)
+        _cache_tablas[codigo_pt] = {"iny": rows_iny, "otros": rows_otros,
+                                    "precios": filas_materiales(codigo_pt)}
+    return _cache_tablas[codigo_pt]
+
+
+def delta_desde_tablas(codigo_pt, tablas):
+    """Compara las tablas editadas con las del dataset y devuelve solo los cambios."""
+    base  = tablas_base(codigo_pt)
+    delta = {}
+    for seccion, (_, clave, campos) in CAMPOS_DELTA.items():
+        originales = {str(r[clave]): r for r in base[seccion]}
+        for row in tablas.get(seccion) or []:
+            orig = originales.get(str(row.get(clave, "")))
+            if orig is None:
+                continue
+            cambios = {c: float(row.get(c) or 0) for c in campos
+                       if float(row.get(c) or 0) != float(orig.get(c) or 0)}
+            if cambios:
+                delta.setdefault(seccion, {})[str(row[clave])] = cambios
+    return delta
+
+
+def delta_relevante(codigo_pt, delta):
+    """Parte del delta que toca alguna fila de las tablas del PT."""
+    base     = tablas_base(codigo_pt)
+    relevante = {}
+    for seccion, (_, clave, _) in CAMPOS_DELTA.items():
+        claves_pt = {str(r[clave]) for r in base[seccion]}
+        cambios   = {k: v for k, v in (delta.get(seccion) or {}).items() if k in claves_pt}
+        if cambios:
+            relevante[seccion] = cambios
+    return relevante
+
+
+def combinar_delta(codigo_pt, anterior, nuevo):
+    """Delta guardado con los cambios de las tablas del PT reemplazados por
+    `nuevo`; los cambios sobre máquinas o componentes de otros PT se conservan."""
+    base      = tablas_base(codigo_pt)
+    combinado = {}
+    for seccion, (_, clave, _) in CAMPOS_DELTA.items():
+        claves_pt = {str(r[clave]) for r in base[seccion]}
+        cambios   = {k: v for k, v in (anterior.get(seccion) or {}).items()
+                     if k not in claves_pt}
+        cambios.update(nuevo.get(seccion) or {})
+        if cambios:
+            combinado[seccion] = cambios
+    return combinado
+
+
+def tablas_escenario(codigo_pt, delta):
+    """Tablas del PT con el delta del escenario superpuesto."""
+    tablas = {}
+    for seccion, (_, clave, _) in CAMPOS_DELTA.items():
+        cambios = delta.get(seccion) or {}
+        tablas[seccion] = [{**row, **cambios.get(str(row[clave]), {})}
+                           for row in tablas_base(codigo_pt)[seccion]]
+    for row in tablas["iny"]:
+        row["Cant.Base"] = round(cant_base_inyeccion(row["T.Ciclo"], row["Cav.Oper"]), 2) \
+                           if row["T.Ciclo"] > 0 else 0
+    return tablas
+
+
+def superponer_delta(codigo_pt, relevante):
+    """Índices de tiempos y precios con el delta aplicado solo a las filas que
+    toca, con las mismas reglas que aplicar_simulacion."""
+    tablas  = tablas_escenario(codigo_pt, relevante)
+    tiempos = {}
+    precios = {}
+
+    def cambiar_maquina(maquina, valores):
+        for semi in SEMIS_MAQUINA.get(maquina, []):
+            tiempos[semi] = {**tiempos.get(semi, TIEMPOS[semi]), **valores}
+
+    for row in tablas["iny"]:
+        maquina = str(row["Maquina"])
+        if maquina in relevante.get("iny", {}) and row["T.Ciclo"] > 0 and row["Cav.Oper"] > 0:
+            cambiar_maquina(maquina, {"Cantidad Base": cant_base_inyeccion(row["T.Ciclo"],
+                                                                           row["Cav.Oper"])})
+    for row in tablas["otros"]:
+        maquina = str(row["Maquina"])
+        if maquina in relevante.get("otros", {}) and row["Cantidad Base"] > 0:
+            valores = {"Cantidad Base": row["Cantidad Base"]}
+            if row["T.MO"]  > 0: valores["T.MO"]  = row["T.MO"]
+            if row["T.Maq"] > 0: valores["T.Maq"] = row["T.Maq"]
+            cambiar_maquina(maquina, valores)
+    for comp, cambios in (relevante.get("precios") or {}).items():
+        if float(cambios.get("Precio") or 0) > 0:
+            precios.update(dict.fromkeys(FILAS_COMPONENTE.get(comp, []), float(cambios["Precio"])))
+    return ChainMap(tiempos, TIEMPOS), ChainMap(precios, COSTO_STD)
+
+
+def evaluar_escenario(codigo_pt, delta):
+    """Costea el PT bajo el escenario. Si el delta no toca sus tablas devuelve el
+    costo base calculado al cargar; si no, se memoiza por la parte relevante del
+    delta, así escenarios que comparten cambios sobre el PT reutilizan el cálculo."""
+    relevante = delta_relevante(codigo_pt, delta)
+    if not relevante:
+        return COSTOS_BASE.get(str(codigo_pt), ({}, 0))
+    return _costear_escenario(codigo_pt, json.dumps(relevante, sort_keys=True))
+
+
+# Caben dos comparaciones A-vs-B completas (a lo sumo dos entradas por PT)
+@lru_cache(maxsize=4 * len(VALIDACION["planes"]))
+def _costear_escenario(codigo_pt, relevante_json):
+    tiempos, costo_std = superponer_delta(codigo_pt, json.loads(relevante_json))
+    resumen, _, costo_x_und = explotar_pt(codigo_pt, df_exp, df_tie,
+                                          tiempos=tiempos, costo_std=costo_std)
+    return resumen, costo_x_und
+
+
+def comparar_escenarios(nombre_a, nombre_b):
+    """Costo por PT del escenario A contra B (vacío = base del dataset)."""
+    delta_a, delta_b = leer_escenario(nombre_a), leer_escenario(nombre_b)
+    filas = []
+    for _, r in lista_pt_dd.iterrows():
+        codigo_pt = r["Código PT"]
+        costo_a = evaluar_escenario(codigo_pt, delta_a)[1]
+        costo_b = evaluar_escenario(codigo_pt, delta_b)[1]
+        dif     = costo_b - costo_a
+        filas.append({
+            "Código PT": codigo_pt, "Descripción PT": r["Descripción PT"],
+            "Costo A": round(costo_a, 6), "Costo B": round(costo_b, 6),
+            "Diferencia": round(dif, 6),
+            "Var %": round(dif / costo_a * 100, 2) if costo_a else 0,
+        })
+    return filas
+
+
+init_escenarios()
+
+
+# ── Planificación de capacidad ──────────────────────────────
+# La demanda (unidades de PT por periodo) se explota con productos de
+# matrices: demanda (periodo × PT) · requerimientos (PT × semi) da las
+# unidades de cada semi, y estas por las horas por unidad agrupadas en
+# matrices (semi × máquina / proceso) dan las horas por periodo.
+def tiempos_planificacion(df_t):
+    """Horas máquina y MO por unidad de cada código con ruta en Tiempos."""
+    t = df_t.drop_duplicates("Código Semi").set_index("Código Semi")
+    proceso = t["Proceso"].astype(str).str.strip().str.upper()
+    maquina = t["Maquina"].astype(str).str.strip() \
+              if "Maquina" in t.columns else pd.Series("", index=t.index)
+    cant_base = t["Cantidad Base"].astype(float)
+    if "T.ciclo" in t.columns and "Cav. Oper" in t.columns:
+        t_ciclo  = pd.to_numeric(t["T.ciclo"],   errors="coerce").fillna(0)
+        cav_oper = pd.to_numeric(t["Cav. Oper"], errors="coerce").fillna(0)
+        es_iny   = proceso.str.contains("INYEC") & (t_ciclo > 0) & (cav_oper > 0)
+        cant_base = cant_base.where(~es_iny,
+                                    cant_base_inyeccion(t_ciclo.where(es_iny, 1), cav_oper))
+    cant_base = cant_base.where(cant_base != 0, 1)
+    return pd.DataFrame({
+        "Proceso": proceso,
+        "Maquina": maquina.where(~maquina.isin(["", "nan"]), "SIN MÁQUINA"),
+        "H.Maq":   t["T.Maq"].astype(float) / cant_base,
+        "H.MO":    t["T.MO"].astype(float)  / cant_base,
+    })
+
+
+def usos_por_nodo(plan):
+    """Veces que se usa cada nodo del plan en el árbol completo del PT. Un nodo
+    compartido por varios padres aparece una sola vez en el plan, así que las
+    referencias se propagan de padres a hijos (post-orden invertido)."""
+    usos = [0] * len(plan["nodos"])
+    for _, ref, _ in plan["raiz"]:
+        if ref is not None and ref != SIN_COSTO:
+            usos[ref] += 1
+    for i in reversed(range(len(plan["nodos"]))):
+        for _, ref, _ in plan["nodos"][i]["entradas"]:
+            if ref is not None and ref != SIN_COSTO:
+                usos[ref] += usos[i]
+    return usos
+
+
+def matriz_requerimientos(df_e, validacion):
+    """Unidades de cada semi (y del propio PT) por unidad de PT: la cantidad de
+    cada nodo del plan por el número de veces que aparece en el árbol."""
+    filas = []
+    for codigo_pt, plan in validacion["planes"].items():
+        if not plan["raiz"]:
+            continue
+        cant_base_pt = float(df_e.at[plan["raiz"][0][0], "Cantidad Base"]) or 1
+        filas.append((codigo_pt, codigo_pt, 1.0))
+        filas.extend((codigo_pt, nodo["semi"], usos * nodo["cant"] / cant_base_pt)
+                     for nodo, usos in zip(plan["nodos"], usos_por_nodo(plan)))
+    req = pd.DataFrame(filas, columns=["Código PT", "Código Semi", "Unidades"])
+    return req.pivot_table(index="Código PT", columns="Código Semi",
+                           values="Unidades", aggfunc="sum", fill_value=0)
+
+
+def matrices_horas(requerimientos, tiempos_plan):
+    """Matrices (semi × máquina) y (semi × proceso) con horas por unidad."""
+    t = tiempos_plan.reindex(requerimientos.columns)
+    t = t[t["Proceso"].notna()]
+    por_maquina = t[["Proceso", "Maquina"]].apply(tuple, axis=1)
+    unos_maq  = pd.get_dummies(por_maquina).astype(float)
+    unos_proc = pd.get_dummies(t["Proceso"]).astype(float)
+    return {
+        "semis":     t.index,
+        "maq_h":     unos_maq.mul(t["H.Maq"], axis=0),
+        "maq_mo":    unos_maq.mul(t["H.MO"],  axis=0),
+        "proc_h":    unos_proc.mul(t["H.Maq"], axis=0),
+        "proc_mo":   unos_proc.mul(t["H.MO"],  axis=0),
+    }
+
+
+def planificar_carga(demanda, requerimientos=None, matrices=None):
+    """Horas máquina / MO por máquina y por proceso para cada periodo.
+    `demanda` es un DataFrame con índice Código PT y una columna por periodo."""
+    requerimientos = REQUERIMIENTOS if requerimientos is None else requerimientos
+    matrices       = MATRICES_HORAS if matrices is None else matrices
+    demanda  = demanda.apply(pd.to_numeric, errors="coerce").fillna(0)
+    demanda  = demanda.groupby(level=0).sum()
+    sin_bom  = [pt for pt in demanda.index if pt not in requerimientos.index]
+    req      = requerimientos.reindex(index=demanda.index, fill_value=0)
+    req      = req.reindex(columns=matrices["semis"], fill_value=0)
+    unidades = demanda.T.to_numpy() @ req.to_numpy()  # periodo × semi
+
+    def horas(clave):
+        m = matrices[clave]
+        return pd.DataFrame(unidades @ m.to_numpy(), index=demanda.columns,
+                            columns=m.columns).T
+
+    return {
+        "maquina_h":  horas("maq_h"),
+        "maquina_mo": horas("maq_mo"),
+        "proceso_h":  horas("proc_h"),
+        "proceso_mo": horas("proc_mo"),
+        "sin_bom":    sin_bom,
+    }
+
+
+def leer_demanda(contenido, nombre_archivo):
+    """Demanda subida en CSV/Excel. Formato ancho (Código PT + una columna por
+    periodo) o largo (Código PT, Periodo, Cantidad)."""
+    _, datos = contenido.split(",", 1)
+    crudo = io.BytesIO(base64.b64decode(datos))
+    df = pd.read_csv(crudo) if nombre_archivo.lower().endswith(".csv") \
+         else pd.read_excel(crudo)
+    df.columns = df.columns.astype(str).str.strip()
+    col_pt = "Código PT" if "Código PT" in df.columns else df.columns[0]
+    df[col_pt] = df[col_pt].astype(str).str.strip()
+    if {"Periodo", "Cantidad"} <= set(df.columns):
+        df = df.pivot_table(index=col_pt, columns="Periodo", values="Cantidad",
+                            aggfunc="sum", fill_value=0)
+    else:
+        df = df.set_index(col_pt)
+        df = df.drop(columns=[c for c in df.columns if "Descripción" in c])
+    df.index.name   = "Código PT"
+    df.columns      = df.columns.astype(str)
+    return df
+
+
+REQUERIMIENTOS = matriz_requerimientos(df_exp, VALIDACION)
+MATRICES_HORAS = matrices_horas(REQUERIMIENTOS, tiempos_planificacion(df_tie))
+PERIODOS_DEMANDA = [f"P{i}" for i in range(1, 7)]
+
+
+def layout():
+    """Se evalúa en cada carga de página: HTML inicial chico y datos al día."""
+    escenarios = listar_escenarios()
+    return html.Div(
+        style={"backgroundColor": COLORES["bg"], "minHeight": "100vh",
+               "fontFamily": "'Segoe UI', sans-serif",
+               "color": COLORES["text"], "padding": "20px"},
+        children=[
+            html.H1("📦 Reporte de Costos por Proceso",
+                    style={"color": COLORES["accent"], "textAlign": "center", "marginBottom": "5px"}),
+            html.P(f"Generado: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+                   style={"color": "#7A9BBF", "textAlign": "center", "marginBottom": "25px"}),
+
+            html.Div(style={"marginBottom": "25px"}, children=[
+                html.Label("Selecciona un Producto Terminado:",
+                           style={"color": COLORES["accent"], "fontWeight": "bold"}),
+                dcc.Dropdown(
+                    id="selector-pt",
+                    options=opciones_pt_iniciales(PT_INICIAL),
+                    value=PT_INICIAL,
+                    placeholder="Escribe código o descripción…",
+                    style={"marginTop": "8px", "color": "#000"}
+                ),
+            ]),
+
+            html.Div(id="kpis", style={"display": "flex", "gap": "15px",
+                                        "marginBottom": "25px", "flexWrap": "wrap"}),
+
+            # Simulador
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginBottom": "20px",
+                            "border": "1px solid #00C8FF"}, children=[
+                html.H3("🔧 Simulador de Inyección — Modifica T.Ciclo y Cav.Oper por Máquina",
+                        style={"color": COLORES["accent"], "fontSize": "16px",
+                               "marginTop": 0, "marginBottom": "10px"}),
+                html.P("Edita los valores en la tabla y presiona Recalcular.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                dash_table.DataTable(
+                    id="tabla-simulador",
+                    columns=[
+                        {"name": "Máquina",        "id": "Maquina",    "editable": False},
+                        {"name": "T.Ciclo (s)",    "id": "T.Ciclo",    "editable": True,  "type": "numeric"},
+                        {"name": "Cav.Oper",       "id": "Cav.Oper",   "editable": True,  "type": "numeric"},
+                        {"name": "Cav.Tot",        "id": "Cav.Tot",    "editable": False},
+                        {"name": "Cant.Base Calc", "id": "Cant.Base",  "editable": False},
+                        {"name": "Tarifa Maq",     "id": "Tarifa Maq", "editable": False},
+                        {"name": "Tarifa MO",      "id": "Tarifa MO",  "editable": False},
+                    ],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"column_editable": True},
+                         "backgroundColor": "#0D2137", "border": "1px solid #00C8FF"},
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                    ],
+                    editable=True, page_action="none",
+                ),
+            ]),
+
+            # Botón recalcular — aplica a AMBOS simuladores
+            html.Div(style={"textAlign": "center", "margin": "15px 0"}, children=[
+                html.Button("🔄 Recalcular Todos los Procesos", id="btn-recalcular",
+                    style={"backgroundColor": COLORES["accent"], "color": "#000",
+                           "fontWeight": "bold", "border": "none", "borderRadius": "8px",
+                           "padding": "12px 40px", "cursor": "pointer", "fontSize": "15px",
+                           "boxShadow": "0 0 15px rgba(0,200,255,0.4)"}),
+                html.Div(id="msg-simulador",
+                         style={"color": "#4CAF50", "fontSize": "13px", "marginTop": "8px"}),
+            ]),
 
-    filas_pt   = df_exp_sim[df_exp_sim["Código PT"]   == str(codigo_pt)]
-    filas_semi = df_exp_sim[df_exp_sim["Código Semi"] == str(codigo_pt)]
-    print(f"DEBUG codigo_pt={codigo_pt}")
-    print(f"DEBUG filas donde Código PT={codigo_pt}: {len(filas_pt)}")
-    print(f"DEBUG filas donde Código Semi={codigo_pt}: {len(filas_semi)}")
-    print(f"DEBUG primeros Código Semi únicos: {df_exp_sim['Código Semi'].unique()[:5]}")
-    resumen_sim, detalle_sim, _ = explotar_pt(codigo_pt, df_exp_sim, df_tie_sim)
-    print(f"DEBUG resumen_sim={resumen_sim}")
+            # Simulador otros procesos
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginBottom": "20px",
+                            "border": "1px solid #4CAF50"}, children=[
+                html.H3("⚙️ Simulador Otros Procesos — Modifica Cantidad Base, T.MO, T.Maq",
+                        style={"color": "#4CAF50", "fontSize": "16px",
+                               "marginTop": 0, "marginBottom": "10px"}),
+                html.P("Edita los valores y presiona Recalcular para ver el impacto.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                dash_table.DataTable(
+                    id="tabla-simulador-otros",
+                    columns=[
+                        {"name": "Proceso",        "id": "Proceso",       "editable": False},
+                        {"name": "Máquina",        "id": "Maquina",       "editable": False},
+                        {"name": "Cantidad Base",  "id": "Cantidad Base", "editable": True,  "type": "numeric"},
+                        {"name": "T.MO",           "id": "T.MO",          "editable": True,  "type": "numeric"},
+                        {"name": "T.Maq",          "id": "T.Maq",         "editable": True,  "type": "numeric"},
+                        {"name": "Cant.Opr",       "id": "Cant.Opr",      "editable": False},
+                        {"name": "Tarifa Maq",     "id": "Tarifa Maq",    "editable": False},
+                        {"name": "Tarifa MO",      "id": "Tarifa MO",     "editable": False},
+                    ],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"column_editable": True},
+                         "backgroundColor": "#0D2137", "border": "1px solid #4CAF50"},
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                    ],
+                    editable=True, page_action="none",
+                ),
+            ]),
+
+            html.Div(style={"display": "grid", "gridTemplateColumns": "1fr 1fr",
+                            "gap": "20px", "marginBottom": "20px"}, children=[
+                html.Div(style={"backgroundColor": COLORES["card"],
+                                "borderRadius": "12px", "padding": "15px"}, children=[
+                    html.H3("Cascada de Costos (S/)", style={"color": COLORES["accent"],
+                            "fontSize": "16px", "marginTop": 0}),
+                    dcc.Graph(id="grafico-cascada")
+                ]),
+                html.Div(style={"backgroundColor": COLORES["card"],
+                                "borderRadius": "12px", "padding": "15px"}, children=[
+                    html.H3("Cascada de Costos (%)", style={"color": COLORES["accent"],
+                            "fontSize": "16px", "marginTop": 0}),
+                    dcc.Graph(id="grafico-cascada-pct")
+                ]),
+            ]),
+
+            html.Div(style={"display": "grid", "gridTemplateColumns": "1fr 1fr",
+                            "gap": "20px", "marginBottom": "20px"}, children=[
+                html.Div(style={"backgroundColor": COLORES["card"],
+                                "borderRadius": "12px", "padding": "15px"}, children=[
+                    html.H3("Costo por Proceso (%)", style={"color": COLORES["accent"],
+                            "fontSize": "16px", "marginTop": 0}),
+                    dcc.Graph(id="grafico-donut")
+                ]),
+                html.Div(style={"backgroundColor": COLORES["card"],
+                                "borderRadius": "12px", "padding": "15px"}, children=[
+                    html.H3("Costo por Proceso (S/)", style={"color": COLORES["accent"],
+                            "fontSize": "16px", "marginTop": 0}),
+                    dcc.Graph(id="grafico-donut-soles")
+                ]),
+            ]),
+
+            # ── Pareto reemplaza tabla resumen ────────────────────
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginBottom": "20px"}, children=[
+                html.H3("📊 Pareto de Costos por Tipo",
+                        style={"color": COLORES["accent"], "fontSize": "16px", "marginTop": 0}),
+                dcc.Graph(id="grafico-pareto")
+            ]),
+
+            # ── Materiales comprados reemplaza detalle componentes ──
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px"}, children=[
+                html.H3("🛒 Materiales Comprados — Precio Editable para Simular",
+                        style={"color": "#4CAF50", "fontSize": "16px", "marginTop": 0}),
+                html.P("Modifica el precio de cualquier material y presiona Recalcular.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                dash_table.DataTable(
+                    id="tabla-materiales",
+                    columns=[
+                        {"name": "Tipo",           "id": "Tipo",           "editable": False},
+                        {"name": "Componente",      "id": "Componente",     "editable": False},
+                        {"name": "Descripción",     "id": "Descripción",    "editable": False},
+                        {"name": "Precio (S/)",     "id": "Precio",         "editable": True, "type": "numeric"},
+                        {"name": "Tipo de Compra",  "id": "Tipo de Compra", "editable": False},
+                        {"name": "MOQ",             "id": "MOQ",            "editable": False},
+                        {"name": "LT-días",         "id": "LT-días",        "editable": False},
+                    ],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"column_editable": True},
+                         "backgroundColor": "#0D2137", "border": "1px solid #4CAF50"},
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                    ],
+                    editable=True, page_size=20,
+                    filter_action="native", sort_action="native",
+                )
+            ]),
+
+            # ── Historial de costos ───────────────────────────────
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginTop": "20px"}, children=[
+                html.H3("📈 Historial de Costos por Versión del Excel",
+                        style={"color": COLORES["accent"], "fontSize": "16px", "marginTop": 0}),
+                html.P("Costo x Und del PT seleccionado en cada versión ingresada, y qué "
+                       "explica cada cambio: precio de materiales, tarifas, tiempos o estructura.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                html.Div(style={"display": "grid", "gridTemplateColumns": "1fr 1fr",
+                                "gap": "20px"}, children=[
+                    dcc.Graph(id="grafico-historial"),
+                    dcc.Graph(id="grafico-atribucion"),
+                ]),
+            ]),
+
+            # ── Planificación de capacidad ────────────────────────
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginTop": "20px",
+                            "border": "1px solid #00BCD4"}, children=[
+                html.H3("🏭 Planificación de Capacidad — Carga de Máquinas y Mano de Obra",
+                        style={"color": "#00BCD4", "fontSize": "16px", "marginTop": 0}),
+                html.P("Sube un plan de demanda (CSV/Excel: Código PT y una columna por periodo, "
+                       "o Código PT, Periodo, Cantidad) o agrega PTs y escribe las unidades. "
+                       "Las celdas en rojo superan las horas disponibles por periodo.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                html.Div(style={"display": "flex", "gap": "10px", "flexWrap": "wrap",
+                                "alignItems": "center", "marginBottom": "10px"}, children=[
+                    dcc.Upload(id="upload-demanda",
+                               children=html.Div("📤 Subir demanda (CSV / Excel)"),
+                               style={"border": "1px dashed #00BCD4", "borderRadius": "8px",
+                                      "padding": "8px 20px", "cursor": "pointer"}),
+                    html.Button("➕ Agregar PT seleccionado", id="btn-agregar-demanda",
+                        style={"backgroundColor": "#1E2D3D", "color": "#00BCD4",
+                               "border": "1px solid #00BCD4", "borderRadius": "8px",
+                               "padding": "8px 20px", "cursor": "pointer"}),
+                    html.Label("Horas disponibles por máquina y periodo:",
+                               style={"color": "#7A9BBF", "fontSize": "13px"}),
+                    dcc.Input(id="horas-periodo", type="number", value=HORAS_PERIODO, min=1,
+                              style={"padding": "8px", "width": "100px"}),
+                    html.Button("📈 Calcular carga", id="btn-calcular-carga",
+                        style={"backgroundColor": "#00BCD4", "color": "#000",
+                               "fontWeight": "bold", "border": "none", "borderRadius": "8px",
+                               "padding": "8px 20px", "cursor": "pointer"}),
+                ]),
+                dash_table.DataTable(
+                    id="tabla-demanda",
+                    columns=[{"name": "Código PT", "id": "Código PT", "editable": False}] +
+                            [{"name": p, "id": p, "editable": True, "type": "numeric"}
+                             for p in PERIODOS_DEMANDA],
+                    data=[],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"column_editable": True},
+                         "backgroundColor": "#0D2137", "border": "1px solid #00BCD4"},
+                    ],
+                    editable=True, row_deletable=True, page_size=15,
+                ),
+                html.Div(id="msg-carga",
+                         style={"color": "#4CAF50", "fontSize": "13px", "margin": "8px 0"}),
+                dcc.Graph(id="grafico-carga"),
+                html.H4("Horas máquina por máquina y periodo",
+                        style={"color": "#00BCD4", "fontSize": "14px"}),
+                dash_table.DataTable(
+                    id="tabla-carga-maquina",
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    page_size=20, sort_action="native", filter_action="native",
+                ),
+                html.H4("Horas por proceso (H.MO por periodo)",
+                        style={"color": "#00BCD4", "fontSize": "14px"}),
+                dash_table.DataTable(
+                    id="tabla-carga-proceso",
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                    ],
+                    page_action="none", sort_action="native",
+                ),
+            ]),
+
+            # ── Validación de la estructura ───────────────────────
+            html.Details(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                                "padding": "15px", "marginTop": "20px",
+                                "border": "1px solid #FF9800"}, children=[
+                html.Summary(
+                    f"🧪 Validación de la estructura (BOM) — "
+                    f"{len(VALIDACION['problemas'])} observación(es)"
+                    if VALIDACION["problemas"] else
+                    "🧪 Validación de la estructura (BOM) — sin observaciones",
+                    style={"color": COLORES["CIF"], "fontSize": "16px",
+                           "fontWeight": "bold", "cursor": "pointer"}),
+                html.P("Revisión hecha al cargar el Excel: ciclos, semis sin ruta en Tiempos "
+                       "y fabricados sin estructura se costean en cero.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "margin": "10px 0"}),
+                dash_table.DataTable(
+                    id="tabla-validacion",
+                    columns=[
+                        {"name": "Código PT",   "id": "Código PT"},
+                        {"name": "Código",      "id": "Código"},
+                        {"name": "Descripción", "id": "Descripción"},
+                        {"name": "Nivel",       "id": "Nivel", "type": "numeric"},
+                        {"name": "Problema",    "id": "Problema"},
+                    ],
+                    data=VALIDACION["problemas"],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                    ],
+                    page_size=15, filter_action="native", sort_action="native",
+                ),
+            ]),
+
+            # ── Escenarios guardados ──────────────────────────────
+            html.Div(style={"backgroundColor": COLORES["card"], "borderRadius": "12px",
+                            "padding": "15px", "marginTop": "20px",
+                            "border": "1px solid #9C27B0"}, children=[
+                html.H3("💾 Escenarios — Guarda, carga y compara simulaciones",
+                        style={"color": "#CE93D8", "fontSize": "16px", "marginTop": 0}),
+                html.P("Guarda las ediciones de las tres tablas con un nombre. "
+                       "Al cargar un escenario se aplican sus cambios al PT seleccionado.",
+                       style={"color": "#7A9BBF", "fontSize": "12px", "marginBottom": "10px"}),
+                html.Div(style={"display": "flex", "gap": "10px", "flexWrap": "wrap",
+                                "alignItems": "center"}, children=[
+                    dcc.Input(id="nombre-escenario", type="text",
+                              placeholder="Nombre del escenario",
+                              style={"padding": "8px", "minWidth": "220px"}),
+                    html.Button("💾 Guardar", id="btn-guardar-escenario",
+                        style={"backgroundColor": "#CE93D8", "color": "#000",
+                               "fontWeight": "bold", "border": "none", "borderRadius": "8px",
+                               "padding": "8px 20px", "cursor": "pointer"}),
+                    dcc.Dropdown(id="selector-escenario", options=escenarios,
+                                 placeholder="Cargar escenario…",
+                                 style={"minWidth": "260px", "color": "#000"}),
+                ]),
+                html.Div(id="msg-escenario",
+                         style={"color": "#4CAF50", "fontSize": "13px", "marginTop": "8px"}),
+
+                html.H4("Comparar escenario A vs B por PT",
+                        style={"color": "#CE93D8", "fontSize": "14px", "marginBottom": "8px"}),
+                html.Div(style={"display": "flex", "gap": "10px", "flexWrap": "wrap",
+                                "alignItems": "center", "marginBottom": "10px"}, children=[
+                    dcc.Dropdown(id="comparar-a", options=escenarios,
+                                 placeholder="A: Base del dataset",
+                                 style={"minWidth": "240px", "color": "#000"}),
+                    dcc.Dropdown(id="comparar-b", options=escenarios,
+                                 placeholder="B: Base del dataset",
+                                 style={"minWidth": "240px", "color": "#000"}),
+                    html.Button("⚖️ Comparar", id="btn-comparar",
+                        style={"backgroundColor": "#CE93D8", "color": "#000",
+                               "fontWeight": "bold", "border": "none", "borderRadius": "8px",
+                               "padding": "8px 20px", "cursor": "pointer"}),
+                ]),
+                dash_table.DataTable(
+                    id="tabla-comparacion",
+                    columns=[
+                        {"name": "Código PT",      "id": "Código PT"},
+                        {"name": "Descripción PT", "id": "Descripción PT"},
+                        {"name": "Costo A (S/)",   "id": "Costo A",    "type": "numeric"},
+                        {"name": "Costo B (S/)",   "id": "Costo B",    "type": "numeric"},
+                        {"name": "Diferencia",     "id": "Diferencia", "type": "numeric"},
+                        {"name": "Var %",          "id": "Var %",      "type": "numeric"},
+                    ],
+                    style_header={"backgroundColor": "#1F3864", "color": "white", "fontWeight": "bold"},
+                    style_cell={"backgroundColor": "#1E2D3D", "color": COLORES["text"],
+                                "border": "1px solid #2A3F54", "padding": "8px", "textAlign": "center"},
+                    style_data_conditional=[
+                        {"if": {"row_index": "odd"}, "backgroundColor": "#162030"},
+                        {"if": {"filter_query": "{Diferencia} > 0", "column_id": "Diferencia"},
+                         "color": "#FF5722"},
+                        {"if": {"filter_query": "{Diferencia} < 0", "column_id": "Diferencia"},
+                         "color": "#4CAF50"},
+                    ],
+                    page_size=20, sort_action="native",
+                ),
+            ]),
+        ]
+    )
+
+
+app.layout = layout
+
+
+@app.callback(
+    Output("selector-pt", "options"),
+    Input("selector-pt",  "search_value"),
+    State("selector-pt",  "value"),
+)
+def opciones_pt(busqueda, codigo_pt):
+    """Top de coincidencias por tecla; siempre incluye el PT ya elegido."""
+    if busqueda is None:
+        raise PreventUpdate
+    codigos = buscar_pt(busqueda)
+    if codigo_pt in POSICION_PT and codigo_pt not in codigos:
+        codigos.append(codigo_pt)
+    return [opcion_pt(c) for c in codigos]
+
+
+@app.callback(
+    Output("tabla-simulador", "data"),
+    Output("tabla-simulador-otros", "data"),
+    Input("selector-pt", "value"),
+    Input("selector-escenario", "value"),
+)
+def cargar_simuladores(codigo_pt, nombre_escenario):
+    tablas = tablas_escenario(codigo_pt, leer_escenario(nombre_escenario))
+    return tablas["iny"], tablas["otros"]
+
+
+@app.callback(
+    Output("tabla-materiales", "data"),
+    Input("selector-pt", "value"),
+    Input("selector-escenario", "value"),
+)
+def cargar_materiales(codigo_pt, nombre_escenario):
+    """Carga todos los materiales COMPRADOS del PT en todos los niveles."""
+    return tablas_escenario(codigo_pt, leer_escenario(nombre_escenario))["precios"]
+
+
+@app.callback(
+    Output("selector-escenario",  "options"),
+    Output("comparar-a",          "options"),
+    Output("comparar-b",          "options"),
+    Output("msg-escenario",       "children"),
+    Input("btn-guardar-escenario","n_clicks"),
+    State("nombre-escenario",     "value"),
+    State("selector-pt",          "value"),
+    State("tabla-simulador",      "data"),
+    State("tabla-simulador-otros","data"),
+    State("tabla-materiales",     "data"),
+    prevent_initial_call=True,
+)
+def guardar_escenario_actual(n_clicks, nombre, codigo_pt, datos_simulador, datos_otros,
+                             datos_materiales):
+    nombre = (nombre or "").strip()
+    if not nombre:
+        opciones = listar_escenarios()
+        return opciones, opciones, opciones, "⚠️ Ingresa un nombre para el escenario"
+    delta = delta_desde_tablas(codigo_pt, {"iny": datos_simulador, "otros": datos_otros,
+                                           "precios": datos_materiales})
+    delta = combinar_delta(codigo_pt, leer_escenario(nombre), delta)
+    guardar_escenario(nombre, delta)
+    n_cambios = sum(len(v) for v in delta.values())
+    opciones  = listar_escenarios()
+    return (opciones, opciones, opciones,
+            f"💾 Escenario '{nombre}' guardado — {n_cambios} cambio(s)")
+
+
+@app.callback(
+    Output("tabla-comparacion", "data"),
+    Input("btn-comparar",       "n_clicks"),
+    State("comparar-a",         "value"),
+    State("comparar-b",         "value"),
+    prevent_initial_call=True,
+)
+def comparar(n_clicks, nombre_a, nombre_b):
+    return comparar_escenarios(nombre_a, nombre_b)
+
+
+@app.callback(
+    Output("grafico-historial",  "figure"),
+    Output("grafico-atribucion", "figure"),
+    Input("selector-pt",         "value"),
+)
+def actualizar_historial(codigo_pt):
+    serie = historial_costos.serie_pt(codigo_pt)
+    fig_hist = go.Figure()
+    fig_atr  = go.Figure()
+    if not serie.empty:
+        x = [f"v{v} · {e}" for v, e in zip(serie["Versión"], serie["Etiqueta"])]
+        for tipo in ["CM", "CIF", "MOD"]:
+            fig_hist.add_trace(go.Bar(
+                x=x, y=serie[tipo], name=tipo, marker_color=COLORES[tipo],
+                hovertemplate=f"<b>{tipo}</b><br>S/ %{{y:.6f}}<extra></extra>"))
+        fig_hist.add_trace(go.Scatter(
+            x=x, y=serie["Costo x Und"], name="Costo x Und", mode="lines+markers",
+            line=dict(color=COLORES["TOTAL"], width=2),
+            hovertemplate="<b>Costo x Und</b><br>S/ %{y:.6f}<extra></extra>"))
+        paleta = ["#2196F3", "#FF9800", "#4CAF50", "#9C27B0"]
+        for color, causa in zip(paleta, [p for p, _, _ in historial_costos.PASOS_ATRIBUCION]
+                                        + ["Δ Estructura"]):
+            fig_atr.add_trace(go.Bar(
+                x=x, y=serie[causa], name=causa, marker_color=color,
+                hovertemplate=f"<b>{causa}</b><br>S/ %{{y:+.6f}}<extra></extra>"))
+    fig_hist.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)",
+                           plot_bgcolor="rgba(0,0,0,0)", barmode="stack",
+                           title="Costo x Und por versión (S/)",
+                           margin=dict(l=10, r=10, t=40, b=60),
+                           legend=dict(orientation="h", y=1.12))
+    fig_atr.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)",
+                          plot_bgcolor="rgba(0,0,0,0)", barmode="relative",
+                          title="Variación vs versión anterior (S/)",
+                          margin=dict(l=10, r=10, t=40, b=60),
+                          legend=dict(orientation="h", y=1.12))
+    return fig_hist, fig_atr
+
+
+@app.callback(
+    Output("tabla-demanda", "data"),
+    Output("tabla-demanda", "columns"),
+    Output("msg-carga",     "children", allow_duplicate=True),
+    Input("upload-demanda", "contents"),
+    Input("btn-agregar-demanda", "n_clicks"),
+    State("upload-demanda", "filename"),
+    State("selector-pt",    "value"),
+    State("tabla-demanda",  "data"),
+    State("tabla-demanda",  "columns"),
+    prevent_initial_call=True,
+)
+def editar_demanda(contenido, n_clicks, nombre_archivo, codigo_pt, datos, columnas):
+    if ctx.triggered_id == "upload-demanda" and contenido:
+        try:
+            demanda = leer_demanda(contenido, nombre_archivo or "")
+        except Exception as e:
+            return datos, columnas, f"⚠️ No se pudo leer {nombre_archivo}: {e}"
+        columnas = [{"name": "Código PT", "id": "Código PT", "editable": False}] + \
+                   [{"name": p, "id": p, "editable": True, "type": "numeric"}
+                    for p in demanda.columns]
+        return (demanda.reset_index().to_dict("records"), columnas,
+                f"📤 {nombre_archivo}: {len(demanda)} PT × {len(demanda.columns)} periodo(s)")
+    datos = datos or []
+    if codigo_pt and all(r.get("Código PT") != codigo_pt for r in datos):
+        datos = datos + [{"Código PT": codigo_pt,
+                          **{c["id"]: 0 for c in columnas if c["id"] != "Código PT"}}]
+    return datos, columnas, ""
+
+
+@app.callback(
+    Output("tabla-carga-maquina", "data"),
+    Output("tabla-carga-maquina", "columns"),
+    Output("tabla-carga-maquina", "style_data_conditional"),
+    Output("tabla-carga-proceso", "data"),
+    Output("tabla-carga-proceso", "columns"),
+    Output("grafico-carga",       "figure"),
+    Output("msg-carga",           "children"),
+    Input("btn-calcular-carga",   "n_clicks"),
+    State("tabla-demanda",        "data"),
+    State("tabla-demanda",        "columns"),
+    State("horas-periodo",        "value"),
+    prevent_initial_call=True,
+)
+def calcular_carga(n_clicks, datos, columnas, horas_periodo):
+    periodos = [c["id"] for c in columnas if c["id"] != "Código PT"]
+    horas_periodo = float(horas_periodo or HORAS_PERIODO)
+    demanda = pd.DataFrame(datos or [], columns=["Código PT"] + periodos)
+    demanda["Código PT"] = demanda["Código PT"].astype(str).str.strip()
+    carga   = planificar_carga(demanda.set_index("Código PT")[periodos])
+
+    maq_h, maq_mo = carga["maquina_h"], carga["maquina_mo"]
+    activas = maq_h.sum(axis=1) > 0
+    maq_h, maq_mo = maq_h[activas], maq_mo[activas]
+    tabla_maq = maq_h.round(2)
+    tabla_maq.insert(0, "Maquina", [m for _, m in maq_h.index])
+    tabla_maq.insert(0, "Proceso", [p for p, _ in maq_h.index])
+    tabla_maq["Total H.Maq"] = maq_h.sum(axis=1).round(2)
+    tabla_maq["Total H.MO"]  = maq_mo.sum(axis=1).round(2)
+    tabla_maq["Uso Máx %"]   = (maq_h.max(axis=1) / horas_periodo * 100).round(1)
+    cols_maq = [{"name": c, "id": c} for c in tabla_maq.columns]
+    estilos  = [{"if": {"row_index": "odd"}, "backgroundColor": "#162030"}] + [
+        {"if": {"filter_query": f"{{{p}}} > {horas_periodo}", "column_id": p},
+         "backgroundColor": "#B71C1C", "color": "white", "fontWeight": "bold"}
+        for p in periodos
+    ] + [{"if": {"filter_query": "{Uso Máx %} > 100", "column_id": "Uso Máx %"},
+          "backgroundColor": "#B71C1C", "color": "white", "fontWeight": "bold"}]
+
+    proc_mo = carga["proceso_mo"]
+    tabla_proc = proc_mo.round(2)
+    tabla_proc.insert(0, "Proceso", proc_mo.index)
+    tabla_proc["Total H.Maq"] = carga["proceso_h"].sum(axis=1).round(2)
+    tabla_proc["Total H.MO"]  = proc_mo.sum(axis=1).round(2)
+    tabla_proc = tabla_proc[tabla_proc["Total H.MO"] + tabla_proc["Total H.Maq"] > 0]
+    cols_proc = [{"name": c, "id": c} for c in tabla_proc.columns]
+
+    uso = maq_h / horas_periodo * 100
+    fig = go.Figure(go.Heatmap(
+        z=uso.values, x=periodos, y=[m for _, m in maq_h.index],
+        colorscale=[[0, "#1E2D3D"], [0.5, "#00BCD4"], [0.8, "#FF9800"], [1, "#B71C1C"]],
+        zmin=0, zmax=max(120, float(uso.values.max()) if uso.size else 0),
+        colorbar=dict(ticksuffix="%"),
+        hovertemplate="<b>%{y}</b> · %{x}<br>Uso %{z:.1f}%<extra></extra>"
+    ))
+    fig.update_layout(template="plotly_dark", paper_bgcolor="rgba(0,0,0,0)",
+                      plot_bgcolor="rgba(0,0,0,0)", title="Uso de capacidad por máquina (%)",
+                      margin=dict(l=10, r=10, t=40, b=40),
+                      height=max(300, 22 * len(maq_h) + 100))
+
+    sobrecargadas = int((maq_h > horas_periodo).any(axis=1).sum())
+    msg = (f"✅ Carga calculada — {len(maq_h)} máquina(s) con carga, "
+           f"{sobrecargadas} sobrecargada(s)")
+    if carga["sin_bom"]:
+        msg += f" · ⚠️ PT sin estructura ignorados: {', '.join(carga['sin_bom'])}"
+    return (tabla_maq.to_dict("records"), cols_maq, estilos,
+            tabla_proc.to_dict("records"), cols_proc, fig, msg)
+
+
+@app.callback(
+    Output("kpis",                "children"),
+    Output("grafico-cascada",     "figure"),
+    Output("grafico-cascada-pct", "figure"),
+    Output("grafico-donut",       "figure"),
+    Output("grafico-donut-soles", "figure"),
+    Output("grafico-pareto",      "figure"),
+    Output("msg-simulador",       "children"),
+    Input("selector-pt",          "value"),
+    Input("btn-recalcular",       "n_clicks"),
+    Input("selector-escenario",   "value"),
+    State("tabla-simulador",      "data"),
+    State("tabla-simulador-otros","data"),
+    State("tabla-materiales",     "data"),
+)
+def actualizar(codigo_pt, n_clicks, nombre_escenario, datos_simulador, datos_otros,
+               datos_materiales):
+    if ctx.triggered_id != "btn-recalcular":
+        # Las tablas aún no reflejan el PT/escenario elegido (se recargan en esta
+        # misma ronda): se costea desde el delta guardado, vacío para la base
+        resumen_sim, _ = evaluar_escenario(codigo_pt, leer_escenario(nombre_escenario))
+    else:
+        df_exp_sim, df_tie_sim = aplicar_simulacion(datos_simulador, datos_otros,
+                                                    datos_materiales)
+        resumen_sim, _, _ = explotar_pt(codigo_pt, df_exp_sim, df_tie_sim)
 
     cant_base_pt = float(df_exp[df_exp["Código Semi"] == codigo_pt]["Cantidad Base"].iloc[0]) \
                    if not df_exp[df_exp["Código Semi"] == codigo_pt].empty else 1
@@ -668,7 +1639,6 @@ def actualizar(codigo_pt, n_clicks, datos_simulador, datos_otros, datos_material
         df_pt["% del Total"] = df_pt["Costo Unitario"] / total if total > 0 else 0
 
     msg    = f"✅ Recalculado — {datetime.now().strftime('%H:%M:%S')}" if n_clicks else ""
-    df_det = df_detalle[df_detalle["Código PT"] == codigo_pt].copy()
     total  = df_pt["Costo Unitario"].sum()
     tot_cm  = df_pt[df_pt["Tipo de Costo"].str.startswith("CM")]["Costo Unitario"].sum()
     tot_mod = df_pt[df_pt["Tipo de Costo"].str.startswith("MOD")]["Costo Unitario"].sum()